@@ -1,55 +1,76 @@
-from django.db.models import Count, Sum, Avg
-from django.db.models.functions import TruncMonth
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from order.models import Order, OrderItem
+from django.conf import settings
+from api.permissions import IsAdminOrCron
+from order.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from product.image_queue import process_pending
 from product.models import Product, Review
+from product.response_cache import cache_stats
 from users.models import User
-from datetime import datetime, timedelta
+from datetime import timedelta
+from django.utils import timezone
+
+def _sum_of(model, field, column):
+    """Sum of `column` over the `model` rows pointing at the outer row through `field`, 0 if none"""
+    sums = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        sum=Sum(column)).values('sum')
+    return Coalesce(Subquery(sums), Value(Decimal('0')), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def _count_of(model, field):
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts), 0, output_field=IntegerField())
+
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def admin_statistics(request):
     # Get date range for monthly data
-
-    print('admin_statistics')
-    end_date = datetime.now()
+    end_date = timezone.now()
     start_date = end_date - timedelta(days=365)  # Last 12 months
     
-    # Monthly sales data
-    monthly_sales = Order.objects.filter(
-        placed_at__range=(start_date, end_date)
-    ).annotate(
-        month=TruncMonth('placed_at')
-    ).values('month').annotate(
-        total_sales=Sum('items__unit_price' * 'items__quantity'),
-        order_count=Count('id')
-    ).order_by('month')
+    # Monthly sales data, archived orders are rolled up separately and added in
+    monthly_sales = defaultdict(lambda: {'total_sales': 0, 'order_count': 0})
+    for model in (Order, ArchivedOrder):
+        rows = model.objects.filter(
+            placed_at__range=(start_date, end_date)
+        ).annotate(
+            month=TruncMonth('placed_at')
+        ).values('month').annotate(
+            total_sales=Sum('total'),
+            order_count=Count('id')
+        ).order_by('month')
+        for item in rows:
+            month = monthly_sales[item['month'].strftime('%Y-%m')]
+            month['total_sales'] += item['total_sales'] or 0
+            month['order_count'] += item['order_count']
     
-    # Most popular products
+    # Most popular products, avg_rating is kept on the product by product.ratings
     popular_products = Product.objects.annotate(
-        total_ordered=Count('orderitem'),
-        avg_rating=Avg('review__ratings')
+        total_ordered=_count_of(OrderItem, 'product') + _count_of(ArchivedOrderItem, 'product')
     ).order_by('-total_ordered')[:10]
     
-    # Top buyers
+    # Top buyers, from the totals stored on the live and archived orders
     top_buyers = User.objects.annotate(
-        total_spent=Sum('order__items__unit_price' * 'order__items__quantity'),
-        order_count=Count('order')
-    ).exclude(total_spent=None).order_by('-total_spent')[:10]
+        total_spent=_sum_of(Order, 'user', 'total') + _sum_of(ArchivedOrder, 'user', 'total'),
+        order_count=_count_of(Order, 'user') + _count_of(ArchivedOrder, 'user')
+    ).filter(order_count__gt=0).order_by('-total_spent')[:10]
     
     # Recent orders
-    recent_orders = Order.objects.annotate(
-        total_amount=Sum('items__unit_price' * 'items__quantity')
-    ).select_related('user').order_by('-placed_at')[:5]
+    recent_orders = Order.objects.select_related('user').order_by('-placed_at')[:5]
     
     return Response({
         'monthly_sales': [{
-            'month': item['month'].strftime('%Y-%m'),
+            'month': month,
             'total_sales': float(item['total_sales']),
             'order_count': item['order_count']
-        } for item in monthly_sales],
+        } for month, item in sorted(monthly_sales.items())],
         'popular_products': [{
             'id': product.id,
             'name': product.name,
@@ -65,7 +86,21 @@ def admin_statistics(request):
         'recent_orders': [{
             'id': order.id,
             'user_email': order.user.email,
-            'total_amount': float(order.total_amount),
-            'created_at': order.created_at
+            'total_amount': float(order.total) if order.total is not None else None,
+            'created_at': order.placed_at
         } for order in recent_orders]
-    })
\ No newline at end of file
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_statistics(request):
+    return Response(cache_stats())
+
+
+# GET because that is what Vercel cron calls (vercel.json)
+@api_view(['GET'])
+@permission_classes([IsAdminOrCron])
+def process_image_uploads(request):
+    requeued, processed = process_pending(limit=settings.PRODUCT_IMAGE_CRON_BATCH)
+    return Response({'requeued': requeued, 'processed': processed})
@@ -1,4 +1,6 @@
 from rest_framework import permissions
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -8,6 +10,16 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return bool(request.user and request.user.is_staff)
 
 
+class IsAdminOrCron(permissions.BasePermission):
+    """Admins, or a scheduled call carrying `Authorization: Bearer <CRON_SECRET>` as Vercel cron sends it"""
+
+    def has_permission(self, request, view):
+        secret = settings.CRON_SECRET
+        if secret and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {secret}'):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
 class FullDjangoModelPermission(permissions.DjangoModelPermissions):
     def __init__(self):
         self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
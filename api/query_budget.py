@@ -0,0 +1,58 @@
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """Execute wrapper that only counts queries, so it is cheap enough to keep on in production"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def query_budget(limit, label='block'):
+    """Count the queries run inside the block and report when more than `limit` were issued.
+
+    Raises QueryBudgetExceeded when settings.QUERY_BUDGET_RAISE is on (debug and tests),
+    otherwise logs a warning.
+    """
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+    if counter.count > limit:
+        message = f"{label} issued {counter.count} queries, budget is {limit}"
+        if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class QueryBudgetMixin:
+    """Enforce a per-action query budget on a viewset.
+
+    query_budgets = {'list': 3, 'retrieve': 2}
+    Actions without an entry are not counted.
+    """
+    query_budgets = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower()) if hasattr(
+            self, 'action_map') else None
+        limit = self.query_budgets.get(action)
+        if limit is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        with query_budget(limit, label=f"{self.__class__.__name__}.{action}"):
+            return super().dispatch(request, *args, **kwargs)
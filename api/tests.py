@@ -1,3 +1,112 @@
+import re
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from order.models import Cart, CartItem, Order
+from product.models import Category, Product, Review
 
-# Create your tests here.
+
+class IndexUsageTest(TestCase):
+    """EXPLAIN the queries hot endpoints send on a synthetic catalog and fail on any full table scan"""
+    categories = 50
+    products = 5000
+    users = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            [User(email=f'user{i}@example.com', password='!') for i in range(cls.users)])
+        categories = Category.objects.bulk_create(
+            [Category(name=f'Category {i}') for i in range(cls.categories)])
+        products = Product.objects.bulk_create([Product(
+            name=f'Product {i}', description='-', price=Decimal(i % 500) + Decimal('0.99'), stock=10,
+            category=categories[i % cls.categories]) for i in range(cls.products)])
+
+        Review.objects.bulk_create([Review(
+            product=products[i % cls.products], user=users[i % cls.users], ratings=i % 5 + 1,
+            comment='-') for i in range(cls.products * 2)])
+        orders = Order.objects.bulk_create([Order(user=users[i % cls.users]) for i in range(cls.products)])
+        Order.objects.filter(pk__in=[order.pk for order in orders[::2]]).update(
+            placed_at=now - timedelta(days=30))
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+        CartItem.objects.bulk_create([CartItem(
+            cart=carts[i % cls.users], product=products[i], quantity=1) for i in range(cls.products)])
+
+        cls.category = categories[7]
+        cls.product = products[42]
+        cls.user = users[3]
+        cls.cart = carts[3]
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return re.findall(r'Seq Scan on (\w+)', plan)
+        # SQLite reports a plain "SCAN <table>" when it reads the whole table
+        return [match.group(1) for match in re.finditer(r'\bSCAN (\w+)(?!\w| USING)', plan)]
+
+    def assertRequestUsesIndexes(self, url, user=None, **params):
+        """EXPLAIN every SELECT the request sends and fail on a full scan of anything but categories"""
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            plan = self.explain(sql)
+            # Categories are a handful of rows, read whole for their tax rates
+            scans = [table for table in self.full_scans(plan) if table != 'product_category']
+            self.assertEqual(scans, [], f'{sql}\n{plan}')
+        return response
+
+    def test_product_filter_by_category_and_price(self):
+        self.assertRequestUsesIndexes(reverse('products-list'), category_id=self.category.pk,
+                                      price__gt=100, price__lt=200, ordering='price')
+
+    def test_product_ordering_by_updated_at_keyset(self):
+        first = self.assertRequestUsesIndexes(reverse('products-list'), pagination='cursor', ordering='-updated_at')
+        self.assertRequestUsesIndexes(first.data['next'])
+
+    def test_latest_products(self):
+        self.assertRequestUsesIndexes(reverse('products-latest'))
+
+    def test_product_reviews_newest_first(self):
+        self.assertRequestUsesIndexes(reverse('product-review-list', args=[self.product.pk]), user=self.user)
+
+    def test_product_reviews_by_rating(self):
+        self.assertRequestUsesIndexes(reverse('product-review-list', args=[self.product.pk]), user=self.user,
+                                      ordering='-ratings')
+
+    def test_my_reviews(self):
+        self.assertRequestUsesIndexes(reverse('reviews-my-reviews'), user=self.user)
+
+    def test_user_orders_newest_first(self):
+        first = self.assertRequestUsesIndexes(reverse('orders-list'), user=self.user, pagination='cursor')
+        self.assertRequestUsesIndexes(first.data['next'], user=self.user)
+
+    def test_cart_items(self):
+        self.assertRequestUsesIndexes(reverse('carts-detail', args=[self.cart.pk]), user=self.user)
+        self.assertRequestUsesIndexes(reverse('cart-item-list', args=[self.cart.pk]), user=self.user)
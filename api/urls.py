@@ -1,8 +1,8 @@
 from django.urls import path, include
-from product.views import ProductViewSet, CategoryViewSet, ReviewViewSet, ProductImageViewSet, WishlistViewSet
+from product.views import ProductViewSet, CategoryViewSet, ReviewViewSet, ProductImageViewSet, ProductImageUploadViewSet, WishlistViewSet
 from order.views import CartViewSet, CartItemViewSet, OrderViewset
 from rest_framework_nested import routers
-from .admin_views import admin_statistics
+from .admin_views import admin_statistics, cache_statistics, process_image_uploads
 
 router = routers.DefaultRouter()
 router.register('products', ProductViewSet, basename='products')
@@ -17,6 +17,8 @@ product_router = routers.NestedDefaultRouter(
 product_router.register('reviews', ReviewViewSet, basename='product-review')
 product_router.register('images', ProductImageViewSet,
                         basename='product-images')
+product_router.register('image-uploads', ProductImageUploadViewSet,
+                        basename='product-image-uploads')
 
 cart_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 cart_router.register('items', CartItemViewSet, basename='cart-item')
@@ -30,4 +32,6 @@ urlpatterns = [
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
     path('admin/statistics/', admin_statistics, name='admin-statistics'),
+    path('admin/cache-statistics/', cache_statistics, name='admin-cache-statistics'),
+    path('admin/image-uploads/process/', process_image_uploads, name='admin-process-image-uploads'),
 ]
@@ -1,3 +1,4 @@
+import sys
 from pathlib import Path
 from datetime import timedelta
 from decouple import config
@@ -105,6 +106,23 @@ DATABASES = {
 }
 
 
+# Cache
+# The catalog cache holds rendered product/category responses (product.response_cache).
+# Local memory is per process: with several workers point it at a shared backend,
+# e.g. CATALOG_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': config('CATALOG_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CATALOG_CACHE_LOCATION', default='catalog'),
+        'TIMEOUT': config('CATALOG_CACHE_TIMEOUT', default=300, cast=int),
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -134,10 +152,39 @@ cloudinary.config(
     api_secret=config('api_secret'),
     secure=True
 )
+# The same account for cloudinary_storage, if it is picked to stage image uploads
+CLOUDINARY_STORAGE = {
+    'CLOUD_NAME': config('cloud_name'),
+    'API_KEY': config('cloudinary_api_key'),
+    'API_SECRET': config('api_secret'),
+}
 
 # Media storage setting
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# Uploads product images and records their variants (product.images);
+# product.images.LocalImageBackend keeps everything under MEDIA_ROOT instead
+PRODUCT_IMAGE_BACKEND = config('PRODUCT_IMAGE_BACKEND', default='product.images.CloudinaryImageBackend')
+
+# Image uploads are staged on storage every instance can read and stored later by
+# the process_image_uploads command or the image upload cron endpoint
+# (product.image_queue); EAGER processes them in the request instead. Staging in
+# the database keeps the request to one local write; a remote backend such as
+# cloudinary_storage.storage.RawMediaCloudinaryStorage uploads the whole file in
+# the request and has the worker download it again
+PRODUCT_IMAGE_STAGING_STORAGE = {
+    'BACKEND': config('PRODUCT_IMAGE_STAGING_BACKEND', default='product.image_queue.DatabaseStagingStorage'),
+    'OPTIONS': {},
+}
+PRODUCT_IMAGE_MAX_ATTEMPTS = config('PRODUCT_IMAGE_MAX_ATTEMPTS', default=3, cast=int)
+# Seconds before the first retry, doubled for each one after
+PRODUCT_IMAGE_RETRY_DELAY = config('PRODUCT_IMAGE_RETRY_DELAY', default=60, cast=float)
+# Uploads the cron endpoint stores per call, keep it within the function timeout
+PRODUCT_IMAGE_CRON_BATCH = config('PRODUCT_IMAGE_CRON_BATCH', default=10, cast=int)
+PRODUCT_IMAGE_QUEUE_EAGER = config('PRODUCT_IMAGE_QUEUE_EAGER', default=False, cast=bool)
+# Vercel sends it as a bearer token with cron calls
+CRON_SECRET = config('CRON_SECRET', default='')
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -174,6 +221,21 @@ REST_FRAMEWORK = {
     # ]
 }
 
+# Seconds a cart entering checkout holds its products' stock (order.reservations)
+STOCK_HOLD_TTL = config('STOCK_HOLD_TTL', default=600, cast=int)
+
+# Seconds a response to a request with an Idempotency-Key is replayed to its retries (order.idempotency)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)
+
+# Settled orders older than this many days are moved to the archive tables by archive_orders (order.archive)
+ORDER_ARCHIVE_AFTER_DAYS = config('ORDER_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+
+# Viewsets using api.query_budget.QueryBudgetMixin log a warning when an
+# action runs more queries than declared; raise instead in debug and under
+# `manage.py test`, which forces DEBUG off
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=DEBUG or TESTING, cast=bool)
+
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
     'ACCESS_TOKEN_LIFETIME': timedelta(days=config('JWT_ACCESS_TOKEN_LIFETIME', default=1, cast=int)),
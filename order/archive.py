@@ -0,0 +1,56 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Value
+from django.utils import timezone
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+# Orders whose payment went through or failed don't change any more
+ARCHIVED_STATUSES = [Order.PAYMENT_STATUS_COMPLETE, Order.PAYMENT_STATUS_FAILED]
+ORDER_FIELDS = ['id', 'placed_at', 'payment_status', 'user_id', 'total', 'item_count']
+ITEM_FIELDS = ['id', 'order_id', 'product_id', 'quantity', 'unit_price']
+
+
+def archive_orders(older_than_days, batch_size=500, now=None):
+    """
+    Move settled orders placed more than `older_than_days` ago, with their
+    items, to the archive tables `batch_size` orders per transaction. Returns
+    how many were moved.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            orders = list(Order.objects.select_for_update().filter(
+                payment_status__in=ARCHIVED_STATUSES, placed_at__lt=cutoff,
+            ).order_by('placed_at', 'id').values(*ORDER_FIELDS)[:batch_size])
+            if not orders:
+                return moved
+            ids = [order['id'] for order in orders]
+            items = OrderItem.objects.filter(order_id__in=ids)
+            ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+            ArchivedOrderItem.objects.bulk_create([ArchivedOrderItem(**item) for item in items.values(*ITEM_FIELDS)])
+            items.delete()
+            Order.objects.filter(pk__in=ids).delete()
+        moved += len(orders)
+
+
+def order_history(user):
+    """
+    `user`'s live and archived orders as {id, placed_at, archived} rows in one
+    queryset, so they can be sorted and paginated together; load_orders turns
+    a page of rows into orders.
+    """
+    live = Order.objects.filter(user=user).values('id', 'placed_at').annotate(archived=Value(False))
+    archived = ArchivedOrder.objects.filter(user=user).values('id', 'placed_at').annotate(archived=Value(True))
+    return live.union(archived, all=True)
+
+
+def load_orders(rows):
+    """Orders and archived orders for `rows` of order_history, in the same order, with their items"""
+    loaded = {}
+    for archived, model in ((False, Order), (True, ArchivedOrder)):
+        ids = [row['id'] for row in rows if bool(row['archived']) == archived]
+        if ids:
+            loaded.update({(archived, order.pk): order
+                           for order in model.objects.filter(pk__in=ids).prefetch_related('items')})
+    return [loaded[bool(row['archived']), row['id']] for row in rows]
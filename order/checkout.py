@@ -0,0 +1,39 @@
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from product.models import Product
+from .models import Cart, CartItem, Order, OrderItem, StockHold
+from .reservations import InsufficientStock, check_available, held_quantities
+
+
+@transaction.atomic
+def checkout(user, cart_id):
+    """
+    Turn the user's cart into an order: snapshot unit prices into OrderItems,
+    take the quantities off the stock and empty the cart, all or nothing.
+    Stock other carts hold isn't sold; the cart's own holds are used up.
+    The same handful of queries whatever the size of the cart.
+    """
+    cart = Cart.objects.select_for_update().filter(pk=cart_id, user=user).first()
+    if cart is None:
+        raise ValidationError({'cart_id': ['Cart not found.']})
+    quantities = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+    if not quantities:
+        raise ValidationError({'cart_id': ['Cart is empty.']})
+
+    # Locked in pk order, so checkouts sharing products queue up instead of deadlocking
+    products = list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').only(
+        'pk', 'price', 'stock'))
+    check_available(products, quantities, held_quantities(quantities, exclude_cart=cart))
+
+    order = Order.objects.create(
+        user=user, total=sum(product.price * quantities[product.pk] for product in products),
+        item_count=sum(quantities.values()))
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=quantities[product.pk], unit_price=product.price)
+        for product in products])
+    # Guarded by the stock in the row as well, for writers that don't take the locks
+    if not Product.objects.decrement_stock(quantities):
+        raise InsufficientStock()
+    CartItem.objects.filter(cart=cart).delete()
+    StockHold.objects.filter(cart=cart).delete()
+    return order
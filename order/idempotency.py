@@ -0,0 +1,100 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from drf_yasg import openapi
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+IDEMPOTENCY_PARAMETERS = [
+    openapi.Parameter(IDEMPOTENCY_HEADER, openapi.IN_HEADER, type=openapi.TYPE_STRING,
+                      description='Unique per request; retries with the same key get the first response '
+                                  'back instead of repeating the request'),
+]
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+def request_hash(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.request_hash != fingerprint:
+        raise IdempotencyKeyReused()
+    return Response(record.response, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(view_method):
+    """
+    Honour the Idempotency-Key header on a view method. The key is inserted
+    in the transaction doing the work, so a concurrent duplicate blocks on the
+    unique constraint until the first commits, then replays its response. Only
+    successful responses are kept; an error rolls the key back with the work
+    and the request can be retried as new.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({IDEMPOTENCY_HEADER: [f'At most {MAX_KEY_LENGTH} characters.']})
+
+        fingerprint = request_hash(request)
+        now = timezone.now()
+        keys = IdempotencyKey.objects.filter(user=request.user, key=key)
+        record = keys.first()
+        if record is not None:
+            if record.expires_at > now:
+                return replay(record, fingerprint)
+            record.delete()
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user, key=key, request_hash=fingerprint,
+                        expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+            except IntegrityError:
+                # A duplicate sent alongside, now committed
+                return replay(keys.get(), fingerprint)
+
+            response = view_method(self, request, *args, **kwargs)
+            if not status.is_success(response.status_code):
+                transaction.set_rollback(True)
+                return response
+            # Stored as the client will see it, e.g. Decimals as numbers
+            record.status_code = response.status_code
+            record.response = json.loads(JSONRenderer().render(response.data))
+            record.save(update_fields=['status_code', 'response'])
+            return response
+    return wrapper
+
+
+def purge_expired(batch_size=1000, now=None):
+    """Delete expired keys `batch_size` at a time, returns how many"""
+    now = now or timezone.now()
+    purged = 0
+    while True:
+        batch = list(IdempotencyKey.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+            'pk', flat=True)[:batch_size])
+        if not batch:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
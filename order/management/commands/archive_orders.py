@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from order.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move settled orders older than ORDER_ARCHIVE_AFTER_DAYS to the archive tables in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        moved = archive_orders(settings.ORDER_ARCHIVE_AFTER_DAYS if days is None else days,
+                               batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} orders'))
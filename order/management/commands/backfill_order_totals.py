@@ -0,0 +1,31 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from order.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Store total and item_count on orders placed before checkout recorded them, a chunk at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        total = Subquery(items.annotate(total=Sum(F('unit_price') * F('quantity'))).values('total'))
+        item_count = Subquery(items.annotate(count=Sum('quantity')).values('count'))
+        money = DecimalField(max_digits=12, decimal_places=2)
+
+        filled, last_pk = 0, 0
+        while True:
+            # Keyset over the pk so each chunk starts where the last one ended
+            batch = list(Order.objects.filter(total__isnull=True, pk__gt=last_pk).order_by('pk').values_list(
+                'pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            filled += Order.objects.filter(pk__in=batch).update(
+                total=Coalesce(total, Value(Decimal('0'), output_field=money), output_field=money),
+                item_count=Coalesce(item_count, 0))
+            last_pk = batch[-1]
+        self.stdout.write(self.style.SUCCESS(f'Stored totals for {filled} orders'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from order.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock holds in batches; run it periodically, expired holds already stop counting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired stock holds'))
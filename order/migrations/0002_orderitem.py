@@ -1,25 +0,0 @@
-# Generated by Django 5.1.5 on 2025-03-13 06:36
-
-import django.db.models.deletion
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('order', '0001_initial'),
-        ('product', '0010_alter_productimage_image_wishlist'),
-    ]
-
-    operations = [
-        migrations.CreateModel(
-            name='OrderItem',
-            fields=[
-                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
-                ('quantity', models.PositiveSmallIntegerField()),
-                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
-                ('order', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='items', to='order.order')),
-                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='product.product')),
-            ],
-        ),
-    ]
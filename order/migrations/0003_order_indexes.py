@@ -0,0 +1,48 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Fold repeated products in a cart into one line before the unique constraint goes on"""
+    CartItem = apps.get_model('order', 'CartItem')
+    duplicates = CartItem.objects.values('cart', 'product').annotate(
+        count=models.Count('pk'), quantity_sum=models.Sum('quantity'), keep=models.Min('pk')
+    ).filter(count__gt=1).order_by()
+    for row in duplicates.iterator():
+        items = CartItem.objects.filter(cart=row['cart'], product=row['product'])
+        items.exclude(pk=row['keep']).delete()
+        items.filter(pk=row['keep']).update(quantity=min(row['quantity_sum'], 32767))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_initial'),
+        ('product', '0007_catalog_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='order.cart'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'placed_at'], name='order_user_placed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_cart_product_unique'),
+        ),
+    ]
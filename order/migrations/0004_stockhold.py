@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0003_order_indexes'),
+        ('product', '0012_review_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveSmallIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('cart', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_holds', to='order.cart')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_holds', to='product.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at'], name='stockhold_product_idx'), models.Index(fields=['expires_at'], name='stockhold_expires_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cart', 'product'), name='stockhold_cart_product_unique')],
+            },
+        ),
+    ]
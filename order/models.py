@@ -11,13 +11,73 @@ class Cart(models.Model):
         return f'Cart for {self.user.email}'
 
 class CartItem(models.Model):
-    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
+    # Covered by the (cart, product) unique constraint
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items', db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_unique'),
+        ]
+
     def __str__(self):
         return f'{self.quantity} x {self.product.name}'
 
+class StockHold(models.Model):
+    """
+    Stock set aside for a cart in checkout until `expires_at`. Available stock
+    is the product's stock less its unexpired holds, so expired rows stop
+    counting by themselves; release_stock_holds deletes them in batches.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_holds', db_index=False)
+    # Covered by the (cart, product) unique constraint
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='stock_holds', db_index=False)
+    quantity = models.PositiveSmallIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='stockhold_cart_product_unique'),
+        ]
+        indexes = [
+            # Active holds of a product
+            models.Index(fields=['product', 'expires_at'], name='stockhold_product_idx'),
+            # The sweeper
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} held for cart {self.cart_id}'
+
+class IdempotencyKey(models.Model):
+    """
+    A user's Idempotency-Key and the response to the first request sent with
+    it, replayed to retries until `expires_at` (order.idempotency). The row is
+    written in the same transaction as the request's work, so it only ever
+    exists with its response filled in.
+    """
+    # Covered by the (user, key) unique constraint
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    key = models.CharField(max_length=255)
+    # sha256 of the method, path and body, a retry must send the same request
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotencykey_user_key_unique'),
+        ]
+        indexes = [
+            # The sweeper
+            models.Index(fields=['expires_at'], name='idempotencykey_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} for user {self.user_id}'
+
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
@@ -32,7 +92,20 @@ class Order(models.Model):
     placed_at = models.DateTimeField(auto_now_add=True)
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
+    # Covered by the (user, placed_at) index
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, db_index=False)
+    # Sum of unit_price * quantity and of quantity over the items, written at checkout;
+    # null on orders from before they were stored until backfill_order_totals runs
+    total = models.DecimalField(max_digits=12, decimal_places=2, null=True, editable=False)
+    item_count = models.PositiveIntegerField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # A user's orders, newest first
+            models.Index(fields=['user', 'placed_at'], name='order_user_placed_idx'),
+            # The monthly rollup of admin_statistics and the archive_orders mover
+            models.Index(fields=['placed_at'], name='order_placed_idx'),
+        ]
 
     def __str__(self):
         return f'Order {self.id} by {self.user.email}'
@@ -44,4 +117,39 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f'{self.quantity} x {self.product.name}'
\ No newline at end of file
+        return f'{self.quantity} x {self.product.name}'
+
+class ArchivedOrder(models.Model):
+    """
+    A settled order moved out of the Order table by archive_orders (order.archive)
+    so the live table stays small. Keeps the order's id, ids never repeat
+    across the two tables.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    placed_at = models.DateTimeField()
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    # Covered by the (user, placed_at) index
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, db_index=False)
+    total = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    item_count = models.PositiveIntegerField(null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'placed_at'], name='archivedorder_user_placed_idx'),
+            models.Index(fields=['placed_at'], name='archivedorder_placed_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived order {self.id} by {self.user.email}'
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.PROTECT, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product.name}'
+
@@ -0,0 +1,83 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from product.models import Product
+from .models import Cart, CartItem, StockHold
+
+
+class InsufficientStock(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Not enough stock for some products in the cart.'
+    default_code = 'insufficient_stock'
+
+    def __init__(self, shortages=()):
+        super().__init__()
+        # Kept as is, APIException would turn the numbers into strings
+        self.detail = {'detail': self.default_detail, 'products': list(shortages)}
+
+
+def active_holds(now=None):
+    return StockHold.objects.filter(expires_at__gt=now or timezone.now())
+
+
+def held_quantities(product_ids, exclude_cart=None, now=None):
+    """{product_id: quantity held by unexpired holds}, leaving out those of `exclude_cart`"""
+    holds = active_holds(now).filter(product_id__in=product_ids)
+    if exclude_cart is not None:
+        holds = holds.exclude(cart=exclude_cart)
+    return dict(holds.order_by().values('product_id').annotate(held=Sum('quantity')).values_list(
+        'product_id', 'held'))
+
+
+def check_available(products, quantities, held):
+    """Raise InsufficientStock for products whose stock less `held` can't cover `quantities`"""
+    short = [{'product_id': product.pk, 'requested': quantities[product.pk],
+              'available': max(product.stock - held.get(product.pk, 0), 0)}
+             for product in products if product.stock - held.get(product.pk, 0) < quantities[product.pk]]
+    if short:
+        raise InsufficientStock(short)
+
+
+@transaction.atomic
+def reserve(cart, ttl=None):
+    """
+    Hold the stock of every item in `cart` for `ttl` seconds (STOCK_HOLD_TTL),
+    replacing the cart's earlier holds. Product rows are only locked for this
+    short transaction, not while the buyer pays. Returns the new holds.
+    """
+    # Serializes reservations of the same cart
+    Cart.objects.select_for_update().filter(pk=cart.pk).first()
+    quantities = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+    if not quantities:
+        raise ValidationError({'cart': ['Cart is empty.']})
+
+    # Same lock order as checkout
+    products = list(Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').only('pk', 'stock'))
+    now = timezone.now()
+    check_available(products, quantities, held_quantities(quantities, exclude_cart=cart, now=now))
+
+    expires_at = now + timedelta(seconds=settings.STOCK_HOLD_TTL if ttl is None else ttl)
+    StockHold.objects.filter(cart=cart).delete()
+    return StockHold.objects.bulk_create([
+        StockHold(cart=cart, product_id=product.pk, quantity=quantities[product.pk], expires_at=expires_at)
+        for product in products])
+
+
+def release(cart):
+    return StockHold.objects.filter(cart=cart).delete()[0]
+
+
+def release_expired(batch_size=1000, now=None):
+    """Delete expired holds `batch_size` at a time so no statement locks many rows, returns how many"""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = list(StockHold.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+            'pk', flat=True)[:batch_size])
+        if not batch:
+            return released
+        released += StockHold.objects.filter(pk__in=batch).delete()[0]
@@ -1,30 +1,77 @@
+from django.db.models import F
 from rest_framework import serializers
-from .models import Cart, CartItem, Order
+from .models import Cart, CartItem, Order, OrderItem, StockHold
 from product.models import Product
 from product.serializers import ProductSerializer
+from product.fieldsets import SparseFieldsetMixin
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(write_only=True, queryset=Product.objects.all())
+    line_total = serializers.SerializerMethodField(help_text='Quantity times the product price, before tax')
+    # Columns behind the fields that aren't model fields, for product.fieldsets.trim_queryset
+    field_columns = {'line_total': ['quantity']}
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'product_id', 'quantity']
+        fields = ['id', 'product', 'product_id', 'quantity', 'line_total']
+
+    def get_line_total(self, item):
+        # Annotated by order.totals when the items were loaded for reading
+        if hasattr(item, 'line_total'):
+            return item.line_total
+        return item.quantity * item.product.price
 
     def create(self, validated_data):
         product = validated_data.pop('product_id')
         cart_id = self.context['cart_id']
-        return CartItem.objects.create(cart_id=cart_id, product=product, **validated_data)
+        # One line per product: adding it again raises the quantity
+        item, created = CartItem.objects.get_or_create(
+            cart_id=cart_id, product=product, defaults=validated_data)
+        if not created:
+            CartItem.objects.filter(pk=item.pk).update(
+                quantity=F('quantity') + validated_data['quantity'])
+            item.refresh_from_db(fields=['quantity'])
+        return item
 
 class CartSerializer(serializers.ModelSerializer):
+    """Expects carts loaded with order.totals annotations and prefetched items"""
     items = CartItemSerializer(many=True, read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True,
+                                        help_text='Sum of the line totals, before tax')
+    tax = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'created_at', 'updated_at']
+        fields = ['id', 'items', 'item_count', 'subtotal', 'tax', 'total', 'created_at', 'updated_at']
+
+
+class CartSummarySerializer(serializers.Serializer):
+    item_count = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class StockHoldSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockHold
+        fields = ['product', 'quantity', 'expires_at']
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'quantity', 'unit_price']
+
 
 class OrderSerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+
     class Meta:
         model = Order
-        fields = ['id', 'placed_at', 'payment_status']
-        read_only_fields = ['payment_status']
\ No newline at end of file
+        fields = ['id', 'placed_at', 'payment_status', 'total', 'item_count', 'items']
+        read_only_fields = ['payment_status']
+
+
+class CheckoutSerializer(serializers.Serializer):
+    cart_id = serializers.IntegerField(help_text='Cart to check out, it is emptied by the order')
\ No newline at end of file
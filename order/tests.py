@@ -0,0 +1,568 @@
+import io
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import close_old_connections, transaction
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from order.models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, IdempotencyKey, Order, OrderItem, StockHold
+from order.serializers import CartSerializer
+from order.totals import annotate_cart_totals, prefetch_cart_items
+from product.fast_serializers import FastReadSerializer
+from product.models import Category, Product, ProductImage
+from product.pricing import tax_rates
+
+
+class CartItemFieldsetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='cart@example.com', password='pass')
+        category = Category.objects.create(name='Hats')
+        cls.cart = Cart.objects.create(user=cls.user)
+        for i in range(3):
+            product = Product.objects.create(name=f'Hat {i}', description='Wool', price=10, stock=5,
+                                             category=category)
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=i + 1)
+
+    def setUp(self):
+        tax_rates()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('cart-item-list', args=[self.cart.pk])
+
+    def test_nested_product_fields_in_one_query(self):
+        with self.assertNumQueries(1) as queries:
+            response = self.client.get(self.url, {'fields': 'quantity,product.name,product.price'})
+        self.assertNotIn('"description"', queries.captured_queries[0]['sql'])
+        self.assertEqual(response.json()[0], {'quantity': 1, 'product': {'name': 'Hat 0', 'price': 10.0}})
+
+    def test_adding_a_product_again_raises_quantity(self):
+        product = CartItem.objects.filter(cart=self.cart).first().product
+        response = self.client.post(self.url, {'product_id': product.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 3)
+        self.assertEqual(CartItem.objects.get(cart=self.cart, product=product).quantity, 3)
+
+
+class CartTotalsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='cart@example.com', password='pass')
+        cls.other = User.objects.create_user(email='other@example.com', password='pass')
+        hats = Category.objects.create(name='Hats')
+        shoes = Category.objects.create(name='Shoes', tax_rate=Decimal('0.2'))
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.hat = Product.objects.create(name='Hat', description='-', price=Decimal('10.00'), stock=5, category=hats)
+        cls.shoe = Product.objects.create(name='Shoe', description='-', price=Decimal('9.99'), stock=5, category=shoes)
+        CartItem.objects.create(cart=cls.cart, product=cls.hat, quantity=2)
+        CartItem.objects.create(cart=cls.cart, product=cls.shoe, quantity=3)
+
+    def setUp(self):
+        # Category writes bump cache generations on commit, which TestCase never reaches
+        caches['catalog'].clear()
+        tax_rates()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('carts-detail', args=[self.cart.pk])
+
+    def test_totals_computed_in_the_database(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual([item['line_total'] for item in data['items']], [20.0, 29.97])
+        # The shoe is 11.99 a unit with its 20% tax
+        self.assertEqual((data['item_count'], data['subtotal'], data['tax'], data['total']), (5, 49.97, 8.0, 57.97))
+
+    def test_query_count_does_not_grow_with_items(self):
+        category = Category.objects.create(name='Socks')
+        for i in range(30):
+            product = Product.objects.create(name=f'Sock {i}', description='-', price=1, stock=5, category=category)
+            ProductImage.objects.create(product=product, image='sample')
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+        # cart with totals, items with products, images
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual((len(response.json()['items']), response.json()['item_count']), (32, 35))
+
+    def test_fast_path_renders_like_the_serializer(self):
+        carts = list(annotate_cart_totals(Cart.objects.all()).prefetch_related(prefetch_cart_items()))
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(FastReadSerializer(CartSerializer, carts, many=True).data),
+                         renderer.render(CartSerializer(carts, many=True).data))
+
+    def test_summary_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('carts-summary', args=[self.cart.pk]))
+        self.assertEqual(response.json(), {'item_count': 5, 'total': 57.97})
+
+    def test_summary_of_an_empty_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        response = self.client.get(reverse('carts-summary', args=[cart.pk]))
+        self.assertEqual(response.json(), {'item_count': 0, 'total': 0.0})
+
+    def test_summary_of_another_users_cart(self):
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(reverse('carts-summary', args=[self.cart.pk])).status_code, 404)
+
+    def test_new_cart_has_zero_totals(self):
+        response = self.client.post(reverse('carts-list'), {})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['items'], response.data['item_count'], response.data['total']), ([], 0, 0))
+
+    def test_added_item_has_line_total(self):
+        response = self.client.post(reverse('cart-item-list', args=[self.cart.pk]),
+                                    {'product_id': self.shoe.pk, 'quantity': 1})
+        self.assertEqual(response.json()['line_total'], 39.96)
+
+
+class CheckoutTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='buyer@example.com', password='pass')
+        cls.other = User.objects.create_user(email='other@example.com', password='pass')
+        cls.category = Category.objects.create(name='Hats')
+        cls.hat = Product.objects.create(name='Hat', description='-', price=Decimal('10.00'), stock=5,
+                                         category=cls.category)
+        cls.cap = Product.objects.create(name='Cap', description='-', price=Decimal('7.50'), stock=2,
+                                         category=cls.category)
+        cls.cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cls.cart, product=cls.hat, quantity=3)
+        CartItem.objects.create(cart=cls.cart, product=cls.cap, quantity=2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, cart):
+        return self.client.post(reverse('orders-list'), {'cart_id': cart.pk}, format='json')
+
+    def test_cart_becomes_an_order(self):
+        response = self.checkout(self.cart)
+        self.assertEqual(response.status_code, 201)
+        items = sorted((item['product'], item['quantity'], item['unit_price']) for item in response.json()['items'])
+        self.assertEqual(items, sorted([(self.hat.pk, 3, 10.0), (self.cap.pk, 2, 7.5)]))
+        self.assertEqual(Product.objects.get(pk=self.hat.pk).stock, 2)
+        self.assertEqual(Product.objects.get(pk=self.cap.pk).stock, 0)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_orders_cannot_be_changed_or_deleted(self):
+        order_id = self.checkout(self.cart).json()['id']
+        url = reverse('orders-detail', args=[order_id])
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertEqual(self.client.put(url, {}, format='json').status_code, 405)
+        self.assertEqual(self.client.patch(url, {}, format='json').status_code, 405)
+        self.assertEqual(Order.objects.get(pk=order_id).items.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.hat.pk).stock, 2)
+
+    def test_unit_price_is_a_snapshot(self):
+        order_id = self.checkout(self.cart).json()['id']
+        Product.objects.filter(pk=self.hat.pk).update(price=99)
+        self.assertEqual(OrderItem.objects.get(order_id=order_id, product=self.hat).unit_price, Decimal('10.00'))
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        with self.assertNumQueries(12) as small:
+            self.checkout(self.cart)
+        cart = Cart.objects.create(user=self.user)
+        for i in range(20):
+            product = Product.objects.create(name=f'Sock {i}', description='-', price=1, stock=5,
+                                             category=self.category)
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+        with self.assertNumQueries(len(small)):
+            self.assertEqual(self.checkout(cart).status_code, 201)
+
+    def test_insufficient_stock_changes_nothing(self):
+        CartItem.objects.filter(cart=self.cart, product=self.cap).update(quantity=3)
+        response = self.checkout(self.cart)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['products'], [{'product_id': self.cap.pk, 'requested': 3, 'available': 2}])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.hat.pk).stock, 5)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 2)
+
+    def test_second_checkout_of_the_same_stock_fails(self):
+        cart = Cart.objects.create(user=self.other)
+        CartItem.objects.create(cart=cart, product=self.hat, quantity=3)
+        self.assertEqual(self.checkout(self.cart).status_code, 201)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.checkout(cart).status_code, 409)
+        self.assertEqual(Product.objects.get(pk=self.hat.pk).stock, 2)
+
+    def test_conditional_decrement_refuses_overselling(self):
+        with transaction.atomic():
+            self.assertFalse(Product.objects.decrement_stock({self.hat.pk: 1, self.cap.pk: 3}))
+            transaction.set_rollback(True)
+        self.assertTrue(Product.objects.decrement_stock({self.hat.pk: 5, self.cap.pk: 2}))
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('stock', flat=True)), [0, 0])
+
+    def test_empty_and_foreign_carts(self):
+        self.assertEqual(self.checkout(Cart.objects.create(user=self.user)).status_code, 400)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.checkout(self.cart).status_code, 400)
+
+
+class StockHoldTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.first, cls.second = [User.objects.create_user(email=f'buyer{i}@example.com', password='pass')
+                                 for i in range(2)]
+        category = Category.objects.create(name='Sneakers')
+        cls.drop = Product.objects.create(name='Drop', description='-', price=100, stock=5, category=category)
+        cls.carts = {}
+        for user in (cls.first, cls.second):
+            cls.carts[user] = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cls.carts[user], product=cls.drop, quantity=3)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def reserve(self, user, method='post'):
+        self.client.force_authenticate(user)
+        return getattr(self.client, method)(reverse('carts-reserve', args=[self.carts[user].pk]))
+
+    def checkout(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse('orders-list'), {'cart_id': self.carts[user].pk}, format='json')
+
+    def test_held_stock_is_not_sold_to_others(self):
+        response = self.reserve(self.first)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()[0]['product'], response.json()[0]['quantity']), (self.drop.pk, 3))
+
+        response = self.reserve(self.second)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['products'], [{'product_id': self.drop.pk, 'requested': 3, 'available': 2}])
+        self.assertEqual(self.checkout(self.second).status_code, 409)
+
+        self.assertEqual(self.checkout(self.first).status_code, 201)
+        self.assertFalse(StockHold.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.drop.pk).stock, 2)
+
+    def test_expired_holds_stop_counting(self):
+        self.reserve(self.first)
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.reserve(self.second).status_code, 200)
+        self.assertEqual(self.checkout(self.second).status_code, 201)
+
+    def test_reserving_again_replaces_the_holds(self):
+        self.reserve(self.first)
+        CartItem.objects.filter(cart=self.carts[self.first]).update(quantity=2)
+        self.reserve(self.first)
+        self.assertEqual(list(StockHold.objects.values_list('quantity', flat=True)), [2])
+
+    def test_release(self):
+        self.reserve(self.first)
+        self.assertEqual(self.reserve(self.first, method='delete').status_code, 204)
+        self.assertEqual(self.reserve(self.second).status_code, 200)
+
+    def test_other_users_cart(self):
+        self.client.force_authenticate(self.second)
+        response = self.client.post(reverse('carts-reserve', args=[self.carts[self.first].pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_sweeper_releases_expired_holds_in_batches(self):
+        now = timezone.now()
+        product_ids = []
+        for i in range(5):
+            product_ids.append(Product.objects.create(
+                name=f'Sock {i}', description='-', price=1, stock=5, category=self.drop.category).pk)
+        cart = self.carts[self.first]
+        StockHold.objects.bulk_create(
+            [StockHold(cart=cart, product_id=pk, quantity=1, expires_at=now - timedelta(minutes=1))
+             for pk in product_ids[:4]]
+            + [StockHold(cart=cart, product_id=product_ids[4], quantity=1, expires_at=now + timedelta(minutes=5))])
+        out = io.StringIO()
+        call_command('release_stock_holds', '--batch-size', '3', stdout=out)
+        self.assertIn('Released 4 expired stock holds', out.getvalue())
+        self.assertEqual(list(StockHold.objects.values_list('product_id', flat=True)), [product_ids[4]])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CheckoutConcurrencyTest(TransactionTestCase):
+    """Parallel checkouts of more than the stock: row locks let exactly `stock` of them through"""
+    buyers = 8
+    stock = 3
+
+    def setUp(self):
+        User = get_user_model()
+        category = Category.objects.create(name='Hats')
+        self.product = Product.objects.create(name='Hat', description='-', price=10, stock=self.stock,
+                                              category=category)
+        self.carts = []
+        for i in range(self.buyers):
+            user = User.objects.create_user(email=f'buyer{i}@example.com', password='pass')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.carts.append(cart)
+
+    def test_no_overselling(self):
+        barrier = threading.Barrier(self.buyers)
+        statuses = []
+
+        def buy(cart):
+            client = APIClient()
+            client.force_authenticate(cart.user)
+            barrier.wait()
+            try:
+                statuses.append(client.post(reverse('orders-list'), {'cart_id': cart.pk}, format='json').status_code)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=buy, args=[cart]) for cart in self.carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] * self.stock + [409] * (self.buyers - self.stock))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 0)
+        self.assertEqual(OrderItem.objects.count(), self.stock)
+
+
+class OrderHistoryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='buyer@example.com', password='pass')
+        category = Category.objects.create(name='Hats')
+        cls.products = [Product.objects.create(name=f'Hat {i}', description='-', price=Decimal('12.50'), stock=100,
+                                               category=category) for i in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_order(self, quantities):
+        cart = Cart.objects.create(user=self.user)
+        for product, quantity in zip(self.products, quantities):
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return self.client.post(reverse('orders-list'), {'cart_id': cart.pk}, format='json').json()
+
+    def test_checkout_stores_totals(self):
+        order = self.place_order([2, 1])
+        self.assertEqual((order['total'], order['item_count']), (37.5, 3))
+        self.assertEqual(Order.objects.get(pk=order['id']).total, Decimal('37.50'))
+
+    def test_paginated_history_in_constant_queries(self):
+        for _ in range(12):
+            self.place_order([1, 2, 3])
+        with self.assertNumQueries(4):  # count, page, orders, items
+            response = self.client.get(reverse('orders-list'))
+        data = response.json()
+        self.assertEqual((data['count'], len(data['results'])), (12, 10))
+        self.assertEqual([len(order['items']) for order in data['results']], [3] * 10)
+        ids = [order['id'] for order in data['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_backfill_command(self):
+        first, second = self.place_order([2, 1]), self.place_order([1, 1, 4])
+        empty = Order.objects.create(user=self.user)
+        Order.objects.update(total=None, item_count=None)
+        out = io.StringIO()
+        call_command('backfill_order_totals', '--batch-size', '2', stdout=out)
+        self.assertIn('Stored totals for 3 orders', out.getvalue())
+        totals = dict((pk, (total, count)) for pk, total, count in Order.objects.values_list('pk', 'total', 'item_count'))
+        self.assertEqual(totals, {first['id']: (Decimal('37.50'), 3), second['id']: (Decimal('75.00'), 6),
+                                  empty.pk: (Decimal('0.00'), 0)})
+
+    def test_admin_statistics(self):
+        self.place_order([2, 1])
+        self.place_order([4])
+        admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+        self.client.force_authenticate(admin)
+        data = self.client.get(reverse('admin-statistics')).json()
+        self.assertEqual(sum(month['total_sales'] for month in data['monthly_sales']), 87.5)
+        self.assertEqual(data['top_buyers'][0], {'id': self.user.pk, 'email': self.user.email,
+                                                 'total_spent': 87.5, 'order_count': 2})
+        self.assertEqual([order['total_amount'] for order in data['recent_orders']], [50.0, 37.5])
+
+
+class IdempotencyKeyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user, cls.other = [User.objects.create_user(email=f'buyer{i}@example.com', password='pass')
+                               for i in range(2)]
+        category = Category.objects.create(name='Hats')
+        cls.hat = Product.objects.create(name='Hat', description='-', price=Decimal('10.00'), stock=5,
+                                         category=category)
+        cls.cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cls.cart, product=cls.hat, quantity=2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, key, cart=None):
+        return self.client.post(reverse('orders-list'), {'cart_id': (cart or self.cart).pk}, format='json',
+                                headers={'Idempotency-Key': key})
+
+    def test_retried_checkout_is_replayed(self):
+        first = self.checkout('order-1')
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):  # the stored response
+            retry = self.checkout('order-1')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.hat.pk).stock, 3)
+
+    def test_retried_cart_item_is_replayed(self):
+        url = reverse('cart-item-list', args=[Cart.objects.create(user=self.user).pk])
+        responses = [self.client.post(url, {'product_id': self.hat.pk, 'quantity': 1}, format='json',
+                                      headers={'Idempotency-Key': 'item-1'}) for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[0].json(), responses[1].json())
+        # Not added a second time, which would have raised the quantity
+        self.assertEqual(CartItem.objects.get(pk=responses[0].json()['id']).quantity, 1)
+
+    def test_key_reused_for_another_request(self):
+        self.checkout('order-1')
+        response = self.checkout('order-1', cart=Cart.objects.create(user=self.user))
+        self.assertEqual(response.status_code, 422)
+
+    def test_failures_are_not_stored(self):
+        Product.objects.filter(pk=self.hat.pk).update(stock=1)
+        self.assertEqual(self.checkout('order-1').status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        Product.objects.filter(pk=self.hat.pk).update(stock=5)
+        self.assertEqual(self.checkout('order-1').status_code, 201)
+
+    def test_keys_are_per_user_and_expire(self):
+        self.checkout('order-1')
+        other_cart = Cart.objects.create(user=self.other)
+        CartItem.objects.create(cart=other_cart, product=self.hat, quantity=1)
+        self.client.force_authenticate(self.other)
+        self.assertNotIn('Idempotent-Replayed', self.checkout('order-1', cart=other_cart).headers)
+
+        CartItem.objects.create(cart=other_cart, product=self.hat, quantity=1)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertNotIn('Idempotent-Replayed', self.checkout('order-1', cart=other_cart).headers)
+        self.assertEqual(Order.objects.filter(user=self.other).count(), 2)
+
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Purged 1 expired idempotency keys', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class IdempotencyConcurrencyTest(TransactionTestCase):
+    """Duplicates sent at once wait for the first on the key's unique index, then replay it"""
+    duplicates = 5
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='buyer@example.com', password='pass')
+        category = Category.objects.create(name='Hats')
+        product = Product.objects.create(name='Hat', description='-', price=10, stock=10, category=category)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+
+    def test_one_order_for_concurrent_duplicates(self):
+        barrier = threading.Barrier(self.duplicates)
+        responses = []
+
+        def post():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                responses.append(client.post(reverse('orders-list'), {'cart_id': self.cart.pk}, format='json',
+                                             headers={'Idempotency-Key': 'order-1'}))
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=post) for _ in range(self.duplicates)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [201] * self.duplicates)
+        self.assertEqual(len({response.json()['id'] for response in responses}), 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class OrderArchiveTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user, cls.other = [User.objects.create_user(email=f'buyer{i}@example.com', password='pass')
+                               for i in range(2)]
+        category = Category.objects.create(name='Hats')
+        cls.hat = Product.objects.create(name='Hat', description='-', price=Decimal('10.00'), stock=100,
+                                         category=category)
+        now = timezone.now()
+        cls.orders = []
+        # Two years of orders, oldest first; every third one still pending
+        for days_ago in range(730, 0, -30):
+            order = Order.objects.create(user=cls.user, total=Decimal('20.00'), item_count=2, payment_status=(
+                Order.PAYMENT_STATUS_PENDING if days_ago % 90 == 70 else Order.PAYMENT_STATUS_COMPLETE))
+            Order.objects.filter(pk=order.pk).update(placed_at=now - timedelta(days=days_ago))
+            OrderItem.objects.create(order=order, product=cls.hat, quantity=2, unit_price=Decimal('10.00'))
+            cls.orders.append(order.pk)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def archive(self, **options):
+        out = io.StringIO()
+        call_command('archive_orders', stdout=out, **options)
+        return out.getvalue()
+
+    def test_moves_settled_old_orders_in_batches(self):
+        old = Order.objects.filter(placed_at__lt=timezone.now() - timedelta(days=365))
+        settled = set(old.exclude(payment_status=Order.PAYMENT_STATUS_PENDING).values_list('pk', flat=True))
+        pending = set(old.filter(payment_status=Order.PAYMENT_STATUS_PENDING).values_list('pk', flat=True))
+        self.assertTrue(settled and pending)
+
+        self.assertIn(f'Archived {len(settled)} orders', self.archive(batch_size=2))
+        self.assertEqual(set(ArchivedOrder.objects.values_list('pk', flat=True)), settled)
+        self.assertEqual(set(ArchivedOrderItem.objects.values_list('order_id', flat=True)), settled)
+        self.assertFalse(Order.objects.filter(pk__in=settled).exists())
+        self.assertTrue(set(Order.objects.values_list('pk', flat=True)) >= pending)
+        self.assertIn('Archived 0 orders', self.archive())
+
+    def test_history_reads_both_tables(self):
+        before = self.client.get(reverse('orders-list'), {'page': 2}).json()
+        self.archive(older_than_days=100)
+        with self.assertNumQueries(6):  # count, page, orders and items from each table
+            after = self.client.get(reverse('orders-list'), {'page': 2}).json()
+        self.assertEqual(after, before)
+        self.assertEqual(after['count'], len(self.orders))
+
+        archived = ArchivedOrder.objects.first()
+        response = self.client.get(reverse('orders-detail', args=[archived.pk]))
+        self.assertEqual((response.status_code, response.json()['items'][0]['quantity']), (200, 2))
+        self.assertEqual(self.client.delete(reverse('orders-detail', args=[archived.pk])).status_code, 405)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(reverse('orders-detail', args=[archived.pk])).status_code, 404)
+
+    def test_cursor_pages_cross_into_the_archive(self):
+        self.archive(older_than_days=100)
+        seen, url = [], reverse('orders-list') + '?pagination=cursor'
+        while url:
+            data = self.client.get(url).json()
+            seen += [order['id'] for order in data['results']]
+            previous, url = data['previous'], data['next']
+        self.assertEqual(seen, sorted(self.orders, reverse=True))
+        self.assertTrue(set(ArchivedOrder.objects.values_list('pk', flat=True)) < set(seen))
+        self.assertEqual([order['id'] for order in self.client.get(previous).json()['results']], seen[10:20])
+
+    def test_admin_statistics_include_archived_orders(self):
+        admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+        self.client.force_authenticate(admin)
+        before = self.client.get(reverse('admin-statistics')).json()
+        self.archive(older_than_days=100)
+        after = self.client.get(reverse('admin-statistics')).json()
+        for key in ('monthly_sales', 'popular_products', 'top_buyers'):
+            self.assertEqual(after[key], before[key])
+        self.assertEqual(after['top_buyers'][0]['order_count'], len(self.orders))
+
@@ -0,0 +1,45 @@
+from decimal import Decimal
+from django.db.models import DecimalField, ExpressionWrapper, F, Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
+from product.pricing import price_with_tax_expression, tax_rates
+from .models import CartItem
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def line_total_expression(prefix=''):
+    """Quantity times the unit price before tax of the cart item at `prefix`"""
+    return ExpressionWrapper(F(f'{prefix}quantity') * F(f'{prefix}product__price'), output_field=MONEY)
+
+
+def line_total_with_tax_expression(rates, prefix=''):
+    # Tax is rounded per unit, like the price_with_tax shown on the product
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * price_with_tax_expression(rates, prefix=f'{prefix}product__'), output_field=MONEY)
+
+
+def cart_totals(rates=None, prefix='items__'):
+    """Aggregates over the items at `prefix`: item_count, subtotal (before tax) and total (with tax)"""
+    rates = tax_rates() if rates is None else rates
+    zero = Value(Decimal('0.00'), output_field=MONEY)
+    return {
+        'item_count': Coalesce(Sum(f'{prefix}quantity'), 0),
+        'subtotal': Coalesce(Sum(line_total_expression(prefix)), zero),
+        'total': Coalesce(Sum(line_total_with_tax_expression(rates, prefix)), zero),
+    }
+
+
+def annotate_line_totals(queryset):
+    return queryset.annotate(line_total=line_total_expression())
+
+
+def annotate_cart_totals(queryset, rates=None):
+    """item_count, subtotal, tax and total per cart, summed by the database in the cart query"""
+    return queryset.annotate(**cart_totals(rates)).annotate(
+        tax=ExpressionWrapper(F('total') - F('subtotal'), output_field=MONEY))
+
+
+def prefetch_cart_items():
+    """A cart's items with their line totals, products and product images in two queries"""
+    return Prefetch('items', queryset=annotate_line_totals(
+        CartItem.objects.select_related('product').prefetch_related('product__images').order_by('pk')))
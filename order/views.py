@@ -1,22 +1,74 @@
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import IsAuthenticated
-from .models import Cart, CartItem, Order
-from .serializers import CartSerializer, CartItemSerializer, OrderSerializer
+from .models import ArchivedOrder, Cart, CartItem, Order
+from .serializers import (CartSerializer, CartItemSerializer, CartSummarySerializer, CheckoutSerializer, OrderSerializer,
+                          StockHoldSerializer)
+from .archive import load_orders, order_history
+from .checkout import checkout
+from .idempotency import IDEMPOTENCY_PARAMETERS, idempotent
+from .reservations import release, reserve
+from .totals import annotate_cart_totals, annotate_line_totals, cart_totals, prefetch_cart_items
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-
-class CartViewSet(ModelViewSet):
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from api.query_budget import QueryBudgetMixin
+from product.paginations import DefaultPagination, KeysetPaginationMixin
+from product.fieldsets import FIELDSET_PARAMETERS, trim_queryset
+from product.fast_serializers import FastReadMixin
+
+class CartViewSet(QueryBudgetMixin, FastReadMixin, ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
+    fast_read_actions = ('list', 'retrieve')
+    # Carts with their totals, items with products, product images; plus the JWT user lookup
+    query_budgets = {'list': 4, 'retrieve': 4, 'summary': 2}
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return annotate_cart_totals(Cart.objects.filter(user=self.request.user)).prefetch_related(
+            prefetch_cart_items())
 
     def get_serializer_context(self):
         return {'request': self.request}
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        cart = serializer.save(user=self.request.user)
+        # Reload with the totals the serializer renders
+        serializer.instance = self.get_queryset().get(pk=cart.pk)
+
+    def perform_update(self, serializer):
+        cart = serializer.save()
+        serializer.instance = self.get_queryset().get(pk=cart.pk)
+
+    @action(detail=True, methods=['get'])
+    @swagger_auto_schema(tags=['Cart'], operation_summary='Item count and total of a cart',
+                         responses={200: CartSummarySerializer})
+    def summary(self, request, pk=None):
+        # One aggregate query, the cart itself isn't loaded
+        summary = Cart.objects.filter(pk=pk, user=request.user).annotate(
+            **cart_totals()).values('item_count', 'total').first()
+        if summary is None:
+            raise Http404
+        return Response(CartSummarySerializer(summary).data)
+
+    @action(detail=True, methods=['post', 'delete'])
+    @swagger_auto_schema(
+        tags=['Cart'],
+        operation_summary='Hold the stock of the cart items while checking out',
+        operation_description="POST holds every item's quantity for STOCK_HOLD_TTL seconds, replacing earlier "
+                              "holds of the cart, or answers 409 with the products short of stock. Held stock "
+                              "isn't sold to other carts. DELETE releases the holds; checkout uses them up.",
+        responses={200: StockHoldSerializer(many=True), 409: 'Not enough stock'},
+    )
+    def reserve(self, request, pk=None):
+        cart = get_object_or_404(Cart.objects.only('pk'), pk=pk, user=request.user)
+        if request.method == 'DELETE':
+            release(cart)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(StockHoldSerializer(reserve(cart), many=True).data)
 
     @swagger_auto_schema(tags=['Cart'], operation_summary='List user\'s cart items')
     def list(self, request, *args, **kwargs):
@@ -47,16 +99,21 @@ class CartItemViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk'])
+        queryset = CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related(
+            'product').prefetch_related('product__images')
+        return annotate_line_totals(trim_queryset(queryset, self.serializer_class, self.request))
 
     def get_serializer_context(self):
-        return {'cart_id': self.kwargs['cart_pk']}
+        return {'request': self.request, 'cart_id': self.kwargs['cart_pk']}
 
-    @swagger_auto_schema(tags=['Cart Items'], operation_summary='List items in a cart')
+    @swagger_auto_schema(tags=['Cart Items'], operation_summary='List items in a cart',
+                         manual_parameters=FIELDSET_PARAMETERS)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    @swagger_auto_schema(tags=['Cart Items'], operation_summary='Add item to cart')
+    @swagger_auto_schema(tags=['Cart Items'], operation_summary='Add item to cart',
+                         manual_parameters=IDEMPOTENCY_PARAMETERS)
+    @idempotent
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
 
@@ -76,36 +133,51 @@ class CartItemViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
-class OrderViewset(ModelViewSet):
+class OrderViewset(QueryBudgetMixin, KeysetPaginationMixin, ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DefaultPagination
+    # Newest first, on the (user, placed_at) index
+    ordering = ['-placed_at', '-id']
+    # A page of orders with their items, and checkout, in the same queries whatever
+    # the number of orders or items; plus the JWT user lookup. Pages and orders
+    # reaching into the archive take two more. An Idempotency-Key adds up to 9 to
+    # checkout: its lookup, insert and stored response, savepoints
+    query_budgets = {'list': 7, 'retrieve': 5, 'create': 20}
+    # Orders are checkout records: their items protect them and their stock is
+    # sold, so they are never edited or deleted through the API
+    http_method_names = ['get', 'post', 'head', 'options']
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
-
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-
-    @swagger_auto_schema(tags=['Orders'], operation_summary='List user\'s orders')
+        return Order.objects.filter(user=self.request.user).order_by(*self.ordering).prefetch_related('items')
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Archived orders can be read, not changed
+            if self.action != 'retrieve':
+                raise
+            return get_object_or_404(
+                ArchivedOrder.objects.prefetch_related('items'), pk=self.kwargs['pk'], user=self.request.user)
+
+    @swagger_auto_schema(tags=['Orders'], operation_summary='List user\'s orders',
+                         operation_description='Newest first, archived orders included')
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
-
-    @swagger_auto_schema(tags=['Orders'], operation_summary='Create a new order')
+        page = self.paginate_queryset(order_history(request.user).order_by(*self.ordering))
+        return self.get_paginated_response(self.get_serializer(load_orders(page), many=True).data)
+
+    @swagger_auto_schema(tags=['Orders'], operation_summary='Check out a cart into a new order',
+                         request_body=CheckoutSerializer,
+                         manual_parameters=IDEMPOTENCY_PARAMETERS,
+                         responses={201: OrderSerializer, 409: 'Not enough stock'})
+    @idempotent
     def create(self, request, *args, **kwargs):
-        return super().create(request, *args, **kwargs)
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = checkout(request.user, serializer.validated_data['cart_id'])
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
     @swagger_auto_schema(tags=['Orders'], operation_summary='Get order details')
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
-
-    @swagger_auto_schema(tags=['Orders'], operation_summary='Update order')
-    def update(self, request, *args, **kwargs):
-        return super().update(request, *args, **kwargs)
-
-    @swagger_auto_schema(tags=['Orders'], operation_summary='Partially update order')
-    def partial_update(self, request, *args, **kwargs):
-        return super().partial_update(request, *args, **kwargs)
-
-    @swagger_auto_schema(tags=['Orders'], operation_summary='Delete order')
-    def destroy(self, request, *args, **kwargs):
-        return super().destroy(request, *args, **kwargs)
\ No newline at end of file
@@ -0,0 +1,65 @@
+from decimal import Decimal
+from django.db.models import Count, Q
+
+# Upper bounds of the price histogram buckets, the last bucket is open ended
+PRICE_BUCKETS = (Decimal('25'), Decimal('50'), Decimal('100'), Decimal('200'), Decimal('500'))
+
+
+def price_ranges(edges=PRICE_BUCKETS):
+    lower = None
+    for upper in edges:
+        yield lower, upper
+        lower = upper
+    yield lower, None
+
+
+def price_range_q(lower, upper):
+    q = Q()
+    if lower is not None:
+        q &= Q(price__gte=lower)
+    if upper is not None:
+        q &= Q(price__lt=upper)
+    return q
+
+
+def filter_q(filters):
+    """Q objects for the category and price (with or without tax) parts of validated ProductFilter data"""
+    category_q, price_q = Q(), Q()
+    if filters.get('category_id') is not None:
+        category_q = Q(category_id=filters['category_id'])
+    if filters.get('price__gt') is not None:
+        price_q &= Q(price__gt=filters['price__gt'])
+    if filters.get('price__lt') is not None:
+        price_q &= Q(price__lt=filters['price__lt'])
+    # Need the queryset annotated by product.pricing.annotate_price_with_tax
+    if filters.get('price_with_tax__gt') is not None:
+        price_q &= Q(price_with_tax__gt=filters['price_with_tax__gt'])
+    if filters.get('price_with_tax__lt') is not None:
+        price_q &= Q(price_with_tax__lt=filters['price_with_tax__lt'])
+    return category_q, price_q
+
+
+def product_facets(queryset, categories, filters):
+    """
+    Per-category counts and a price histogram for `queryset` in one aggregate
+    query, one conditional COUNT per bucket. Each facet is counted with the
+    other facet's filter applied but not its own, so picking a category still
+    shows how many matches the other categories have.
+    """
+    category_q, price_q = filter_q(filters)
+    ranges = list(price_ranges())
+
+    aggregates = {'total': Count('pk', filter=(category_q & price_q) or None)}
+    for category_id, _ in categories:
+        aggregates[f'category_{category_id}'] = Count('pk', filter=Q(category_id=category_id) & price_q)
+    for index, (lower, upper) in enumerate(ranges):
+        aggregates[f'price_{index}'] = Count('pk', filter=(price_range_q(lower, upper) & category_q) or None)
+    counts = queryset.order_by().aggregate(**aggregates)
+
+    return {
+        'total': counts['total'],
+        'categories': [{'id': category_id, 'name': name, 'count': counts[f'category_{category_id}']}
+                       for category_id, name in categories],
+        'price_ranges': [{'min': lower, 'max': upper, 'count': counts[f'price_{index}']}
+                         for index, (lower, upper) in enumerate(ranges)],
+    }
@@ -0,0 +1,160 @@
+import decimal
+from operator import attrgetter
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.manager import BaseManager
+from rest_framework import serializers
+from rest_framework.fields import Field
+from rest_framework.relations import PKOnlyObject, RelatedField
+from rest_framework.settings import api_settings
+
+
+def compile_representation(serializer):
+    """
+    Return a function instance -> dict equal to `serializer.to_representation`.
+    Field accessors are resolved once: model columns are read with attrgetter
+    and converted inline, method fields call the serializer's method, nested
+    serializers are compiled the same way. Anything else goes through the
+    field's own get_attribute/to_representation.
+    """
+    accessors = [(field.field_name, compile_field(field)) for field in serializer._readable_fields]
+
+    def represent(instance):
+        return {name: accessor(instance) for name, accessor in accessors}
+    return represent
+
+
+def compile_field(field):
+    if isinstance(field, serializers.ListSerializer) and isinstance(field.child, serializers.Serializer):
+        return _many(field, compile_representation(field.child))
+    if isinstance(field, serializers.Serializer):
+        return _one(field, compile_representation(field))
+    if isinstance(field, serializers.SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+
+    model_field = _model_field(field)
+    # ModelField and friends hand the whole instance to to_representation
+    if model_field is None or type(field).get_attribute not in (Field.get_attribute, RelatedField.get_attribute):
+        return _generic(field)
+    if isinstance(field, RelatedField):
+        if not field.use_pk_only_optimization() or getattr(field, 'pk_field', None) is not None:
+            return _generic(field)
+        return _column(model_field.attname, None)
+    if model_field.is_relation:
+        return _generic(field)
+    return _column(field.source, _converter(field))
+
+
+def _model_field(field):
+    model = getattr(getattr(field.parent, 'Meta', None), 'model', None)
+    if model is None or len(field.source_attrs) != 1:
+        return None
+    try:
+        return model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+
+
+def _converter(field):
+    if type(field) is serializers.IntegerField:
+        return int
+    if type(field) is serializers.CharField:
+        return str
+    if (type(field) is serializers.DecimalField
+            and not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+            and not field.normalize_output and field.decimal_places is not None):
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        rounding = field.rounding
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+
+        def quantize(value):
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            return value.quantize(exponent, rounding=rounding, context=context)
+        return quantize
+    return field.to_representation
+
+
+def _column(attname, convert):
+    get = attrgetter(attname)
+    if convert is None:
+        return get
+
+    def accessor(instance):
+        value = get(instance)
+        return None if value is None else convert(value)
+    return accessor
+
+
+def _manager_getter(field):
+    # Plain attribute access for a single step source, skipping DRF's callable checks
+    if len(field.source_attrs) == 1 and type(field).get_attribute is Field.get_attribute:
+        return attrgetter(field.source)
+    return field.get_attribute
+
+
+def _many(field, represent):
+    get = _manager_getter(field)
+
+    def accessor(instance):
+        related = get(instance)
+        if related is None:
+            return None
+        items = related.all() if isinstance(related, BaseManager) else related
+        return [represent(item) for item in items]
+    return accessor
+
+
+def _one(field, represent):
+    # DRF's lookup turns a missing reverse one-to-one into None
+    get = field.get_attribute
+
+    def accessor(instance):
+        related = get(instance)
+        return None if related is None else represent(related)
+    return accessor
+
+
+def _generic(field):
+    get, to_representation = field.get_attribute, field.to_representation
+
+    def accessor(instance):
+        attribute = get(instance)
+        check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        return None if check_for_none is None else to_representation(attribute)
+    return accessor
+
+
+class FastReadSerializer:
+    """
+    Read-only stand-in for `serializer_class` on hot list endpoints: the same
+    output (sparse fieldsets included) built from loaded, prefetched rows by
+    compiled accessors instead of DRF's per-field machinery.
+    """
+
+    def __init__(self, serializer_class, instance=None, many=False, context=None, **kwargs):
+        self.serializer_class = serializer_class
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @property
+    def data(self):
+        represent = compile_representation(self.serializer_class(context=self.context))
+        if self.many:
+            items = self.instance.all() if isinstance(self.instance, BaseManager) else self.instance
+            return [represent(item) for item in items]
+        return represent(self.instance)
+
+
+class FastReadMixin:
+    """Render GETs of `fast_read_actions` with FastReadSerializer"""
+    fast_read_actions = ('list',)
+
+    def get_serializer(self, *args, **kwargs):
+        if (self.action in self.fast_read_actions and self.request.method == 'GET'
+                and not getattr(self, 'swagger_fake_view', False)):
+            return FastReadSerializer(
+                self.get_serializer_class(), *args, context=self.get_serializer_context(), **kwargs)
+        return super().get_serializer(*args, **kwargs)
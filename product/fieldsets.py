@@ -0,0 +1,136 @@
+from django.core.exceptions import FieldDoesNotExist
+from drf_yasg import openapi
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import BaseSerializer
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+FIELDSET_PARAMETERS = [
+    openapi.Parameter(FIELDS_PARAM, openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description='Comma separated fields to return, dotted for nested ones, e.g. `id,name,images`'),
+    openapi.Parameter(OMIT_PARAM, openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description='Comma separated fields to leave out, e.g. `description,product.images`'),
+]
+
+
+def parse_fieldset(value):
+    """'id,name,product.price' -> {'id': {}, 'name': {}, 'product': {'price': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for part in path.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def get_fieldset(request):
+    """(fields, omit) trees from the query string, fields is None when every field is wanted"""
+    if request is None or request.method not in SAFE_METHODS:
+        return None, {}
+    params = request.query_params
+    fields = parse_fieldset(params[FIELDS_PARAM]) if params.get(FIELDS_PARAM) else None
+    return fields, parse_fieldset(params.get(OMIT_PARAM, ''))
+
+
+def is_selected(name, fields, omit):
+    # An omitted name with children only omits those children
+    return (fields is None or name in fields) and not (name in omit and not omit[name])
+
+
+def nested_fieldset(name, fields, omit):
+    return (fields.get(name) or None) if fields is not None else None, omit.get(name, {})
+
+
+class SparseFieldsetMixin:
+    """
+    Render only the fields asked for with `?fields=` and drop those in `?omit=`.
+    Reads only, writes always see every field. Serializers nested in one using
+    this mixin take dotted paths, e.g. `?fields=id,product.name,product.price`.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = getattr(self, '_fieldset', None)
+        if fieldset is None:
+            if not self.is_top_level():
+                return fields
+            fieldset = get_fieldset(self.context.get('request'))
+
+        requested, omit = fieldset
+        for name in list(fields):
+            if not is_selected(name, requested, omit):
+                del fields[name]
+                continue
+            nested = getattr(fields[name], 'child', fields[name])
+            if isinstance(nested, SparseFieldsetMixin):
+                nested._fieldset = nested_fieldset(name, requested, omit)
+        return fields
+
+    def is_top_level(self):
+        parent = self.parent
+        return parent is None or (getattr(parent, 'child', None) is self and parent.parent is None)
+
+
+def trim_queryset(queryset, serializer_class, request, extra_columns=()):
+    """
+    Load only what a sparse fieldset renders: `.only()` the columns behind the
+    selected fields, select nested objects and prefetch nested lists only if
+    they are rendered. Falls back to `queryset` unchanged when a field's
+    columns can't be worked out; serializers list those in `field_columns`.
+    `extra_columns` are loaded as well when they are model fields, e.g. the
+    ordering fields keyset pagination reads back from the page.
+    """
+    fields, omit = get_fieldset(request)
+    if fields is None and not omit:
+        return queryset
+
+    plan = _plan(serializer_class(), fields, omit, prefix='')
+    if plan is None:
+        return queryset
+    columns, select, prefetch = plan
+    columns.update(column for column in extra_columns if _is_field(queryset.model, column))
+    queryset = queryset.prefetch_related(None).prefetch_related(*prefetch)
+    if select:
+        queryset = queryset.select_related(*select)
+    return queryset.only(*columns)
+
+
+def _plan(serializer, fields, omit, prefix):
+    model = serializer.Meta.model
+    field_columns = getattr(serializer, 'field_columns', {})
+    columns, select, prefetch = {prefix + model._meta.pk.name}, [], []
+
+    for name, field in serializer.fields.items():
+        if field.write_only or not is_selected(name, fields, omit):
+            continue
+        source = prefix + field.source
+        nested = getattr(field, 'child', field)
+        if isinstance(nested, BaseSerializer):
+            if nested is not field:
+                prefetch.append(source)
+                continue
+            plan = _plan(nested, *nested_fieldset(name, fields, omit), prefix=source + '__')
+            if plan is None:
+                return None
+            columns.add(source)
+            columns.update(plan[0])
+            select.append(source)
+            select.extend(plan[1])
+            prefetch.extend(plan[2])
+        elif name in field_columns:
+            columns.update(prefix + column for column in field_columns[name])
+        elif _is_field(model, field.source):
+            columns.add(source)
+        else:
+            return None
+    return columns, select, prefetch
+
+
+def _is_field(model, name):
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
@@ -1,11 +1,39 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import FilterSet, NumberFilter
+from rest_framework.filters import OrderingFilter, SearchFilter
 from product.models import Product
+from product.search import search_products
 
 
 class ProductFilter(FilterSet):
+    # A plain number rather than a model choice, so the category isn't looked up to validate it
+    category_id = NumberFilter(field_name='category_id')
+    # Annotated by product.pricing.annotate_price_with_tax
+    price_with_tax__gt = NumberFilter(field_name='price_with_tax', lookup_expr='gt')
+    price_with_tax__lt = NumberFilter(field_name='price_with_tax', lookup_expr='lt')
+
     class Meta:
         model = Product
         fields = {
             'category_id': ['exact'],
             'price': ['gt', 'lt']
         }
+
+
+class ProductSearchFilter(SearchFilter):
+    """Full-text `?search=` over the product search vector, ranked by relevance"""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search_products(queryset, query)
+
+
+class StableOrderingFilter(OrderingFilter):
+    """OrderingFilter with the primary key as tie-breaker, so page boundaries don't shift between requests"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        if ordering and not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('-pk' if ordering[0].startswith('-') else 'pk')
+        return ordering
@@ -0,0 +1,172 @@
+import logging
+import os
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+from product.images import HashingFile, store_or_reuse
+from product.models import ProductImage, ProductImageUpload, StagedFile
+
+logger = logging.getLogger(__name__)
+
+# Processing for longer than this means the worker is gone
+STALE_AFTER = timedelta(minutes=10)
+
+
+def get_staging_storage():
+    """
+    Storage the staged files live on until they are stored. It has to be
+    shared: the upload is staged by one instance and processed by another.
+    """
+    storage = settings.PRODUCT_IMAGE_STAGING_STORAGE
+    return import_string(storage['BACKEND'])(**storage.get('OPTIONS', {}))
+
+
+@deconstructible
+class DatabaseStagingStorage(Storage):
+    """
+    Staged files as StagedFile rows: shared by every instance, written in the
+    request's own transaction and read back by the worker without going
+    through a remote storage twice
+    """
+
+    def _save(self, name, content):
+        StagedFile.objects.create(name=name, content=b''.join(content.chunks()))
+        return name
+
+    def _open(self, name, mode='rb'):
+        content = StagedFile.objects.filter(name=name).values_list('content', flat=True).first()
+        if content is None:
+            raise FileNotFoundError(name)
+        return ContentFile(bytes(content), name=name)
+
+    def delete(self, name):
+        StagedFile.objects.filter(name=name).delete()
+
+    def exists(self, name):
+        return StagedFile.objects.filter(name=name).exists()
+
+
+def stage_upload(product_id, file, replaces=None):
+    """
+    Copy `file` to the staging storage, hashing it on the way, and record it
+    as a pending upload of a new image for the product, or of a new file for
+    the `replaces` image. With PRODUCT_IMAGE_QUEUE_EAGER it is processed once
+    the transaction commits, otherwise by the next process_pending() run.
+    """
+    extension = os.path.splitext(file.name)[1].lower()
+    hashing = HashingFile(file)
+    hashing.seek(0)
+    staged_file = get_staging_storage().save(f'image-uploads/{uuid.uuid4().hex}{extension}', hashing)
+    upload = ProductImageUpload.objects.create(
+        product_id=product_id, staged_file=staged_file, content_hash=hashing.hexdigest(),
+        image=replaces, replaces_image=replaces is not None)
+    if settings.PRODUCT_IMAGE_QUEUE_EAGER:
+        transaction.on_commit(lambda: process_eagerly(upload.pk))
+    return upload
+
+
+def process_upload(upload_id):
+    """
+    One attempt at storing a staged upload through the image backend, which
+    validates, re-encodes and uploads it, unless an image with the same
+    content already exists. Returns the delay in seconds before the next
+    attempt, which is scheduled on the upload, or None when there is nothing
+    left to do. Invalid images fail at once; other errors are retried up to
+    PRODUCT_IMAGE_MAX_ATTEMPTS.
+    """
+    # Claiming with a conditional update keeps two workers off the same upload
+    claimed = ProductImageUpload.objects.filter(pk=upload_id, status=ProductImageUpload.PENDING).update(
+        status=ProductImageUpload.PROCESSING, attempts=F('attempts') + 1, updated_at=timezone.now())
+    if not claimed:
+        return None
+    upload = ProductImageUpload.objects.get(pk=upload_id)
+    storage = get_staging_storage()
+    if upload.replaces_image and upload.image_id is None:
+        finish(upload, storage, ProductImageUpload.FAILED, error='The image was deleted.')
+        return None
+
+    try:
+        with storage.open(upload.staged_file) as file:
+            image, variants = store_or_reuse(File(file, name=upload.staged_file), upload.content_hash)
+    except ValidationError as error:
+        finish(upload, storage, ProductImageUpload.FAILED, error=' '.join(error.messages))
+        return None
+    except Exception as error:
+        if upload.attempts >= settings.PRODUCT_IMAGE_MAX_ATTEMPTS:
+            logger.exception('Image upload %s failed after %s attempts', upload.pk, upload.attempts)
+            finish(upload, storage, ProductImageUpload.FAILED, error=repr(error))
+            return None
+        logger.warning('Image upload %s attempt %s failed: %r', upload.pk, upload.attempts, error)
+        delay = settings.PRODUCT_IMAGE_RETRY_DELAY * 2 ** (upload.attempts - 1)
+        now = timezone.now()
+        ProductImageUpload.objects.filter(pk=upload.pk).update(
+            status=ProductImageUpload.PENDING, error=repr(error),
+            next_attempt_at=now + timedelta(seconds=delay), updated_at=now)
+        return delay
+
+    with transaction.atomic():
+        if upload.replaces_image:
+            target = ProductImage.objects.select_for_update().filter(pk=upload.image_id).first()
+            if target is None:
+                upload.image = None
+                finish(upload, storage, ProductImageUpload.FAILED, error='The image was deleted.')
+                return None
+            target.image, target.variants, target.content_hash = image, variants, upload.content_hash
+            # Saved rather than updated, so the cache and the product's ETag move with the file
+            target.save(update_fields=['image', 'variants', 'content_hash'])
+        else:
+            upload.image = ProductImage.objects.create(
+                product_id=upload.product_id, image=image, variants=variants, content_hash=upload.content_hash)
+        finish(upload, storage, ProductImageUpload.DONE)
+    return None
+
+
+def process_eagerly(upload_id):
+    """Process an upload in the calling thread, retries included without waiting"""
+    while process_upload(upload_id) is not None:
+        pass
+
+
+def finish(upload, storage, status, error=''):
+    if upload.staged_file:
+        storage.delete(upload.staged_file)
+    upload.staged_file = ''
+    upload.status = status
+    upload.error = error
+    upload.save(update_fields=['staged_file', 'status', 'error', 'image', 'updated_at'])
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Put back uploads left processing by a worker that died, e.g. on a function timeout"""
+    return ProductImageUpload.objects.filter(
+        status=ProductImageUpload.PROCESSING, updated_at__lt=timezone.now() - older_than,
+    ).update(status=ProductImageUpload.PENDING, next_attempt_at=timezone.now(), updated_at=timezone.now())
+
+
+def process_pending(limit=None, stale_after=STALE_AFTER):
+    """
+    One run of the queue, from the process_image_uploads command or the cron
+    endpoint: requeue stale uploads, then give each due upload, oldest first,
+    one attempt. Returns (requeued, processed).
+    """
+    requeued = requeue_stale(stale_after)
+    due = ProductImageUpload.objects.filter(
+        status=ProductImageUpload.PENDING, next_attempt_at__lte=timezone.now(),
+    ).order_by('next_attempt_at').values_list('pk', flat=True)
+    upload_ids = list(due[:limit] if limit else due)
+    for upload_id in upload_ids:
+        try:
+            process_upload(upload_id)
+        except Exception:
+            # Left processing, requeue_stale puts it back
+            logger.exception('Image upload %s crashed', upload_id)
+    return requeued, len(upload_ids)
@@ -0,0 +1,152 @@
+import hashlib
+import io
+import os
+import uuid
+from urllib.request import urlopen
+from cloudinary import CloudinaryResource, uploader
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+from PIL import Image, UnidentifiedImageError
+from product.models import ImageAsset
+
+# Responsive renditions recorded for every product image, widths are upper bounds
+IMAGE_VARIANTS = {
+    'thumbnail': {'width': 200, 'format': 'webp'},
+    'card': {'width': 600, 'format': 'webp'},
+    'zoom': {'width': 1600, 'format': 'jpg'},
+}
+
+
+def get_image_backend():
+    return import_string(settings.PRODUCT_IMAGE_BACKEND)()
+
+
+class HashingFile(File):
+    """
+    Hashes `file` as it is read, e.g. while a storage copies it, through
+    chunks() or read(); seeking back to the start starts the hash over
+    """
+
+    def __init__(self, file):
+        super().__init__(file, name=file.name)
+        self.digest = hashlib.sha256()
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        self.digest.update(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if (offset, whence) == (0, os.SEEK_SET):
+            self.digest = hashlib.sha256()
+        return self.file.seek(offset, whence)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def hash_file(file, chunk_size=File.DEFAULT_CHUNK_SIZE):
+    """sha256 of a file read a chunk at a time"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_or_reuse(file, content_hash):
+    """
+    (image, variants) for `file`: those of the asset with the same content when
+    there is one, so identical photos share one upload, else a fresh upload
+    recorded as that asset
+    """
+    if not content_hash:
+        return get_image_backend().store(file)
+    asset = ImageAsset.objects.filter(content_hash=content_hash).first()
+    if asset is None:
+        image, variants = get_image_backend().store(file)
+        try:
+            with transaction.atomic():
+                asset = ImageAsset.objects.create(content_hash=content_hash, image=image, variants=variants)
+        except IntegrityError:
+            # The same file was stored alongside, keep the asset that got recorded first
+            asset = ImageAsset.objects.get(content_hash=content_hash)
+    return asset.image, asset.variants
+
+
+class CloudinaryImageBackend:
+    """Upload to Cloudinary with the variants as eager transformations, so they exist before the first view"""
+
+    def eager(self):
+        return [{'width': spec['width'], 'crop': 'limit', 'format': spec['format'], 'quality': 'auto'}
+                for spec in IMAGE_VARIANTS.values()]
+
+    def store(self, file):
+        """Return the value for ProductImage.image and the variants of `file`"""
+        resource = uploader.upload_resource(file, resource_type='image', eager=self.eager())
+        return resource.get_prep_value(), self.variants(resource.metadata['eager'])
+
+    def derive(self, image):
+        """Variants for an image uploaded before they were recorded"""
+        result = uploader.explicit(image.public_id, type='upload', resource_type='image', eager=self.eager())
+        return self.variants(result['eager'])
+
+    def open_original(self, image):
+        return urlopen(image.build_url())
+
+    def variants(self, eager_results):
+        return {name: {'url': result['secure_url'], 'width': result['width'],
+                       'height': result['height'], 'format': spec['format']}
+                for (name, spec), result in zip(IMAGE_VARIANTS.items(), eager_results)}
+
+
+class LocalImageBackend:
+    """
+    Filesystem stand-in for Cloudinary (tests, offline development): keeps the
+    original and Pillow-resized variants under MEDIA_ROOT/products.
+    """
+    pil_formats = {'jpg': 'JPEG', 'webp': 'WEBP', 'png': 'PNG'}
+
+    def __init__(self):
+        self.storage = FileSystemStorage()
+
+    def store(self, file):
+        picture = self.open(file)
+        extension = (picture.format or 'jpeg').lower().replace('jpeg', 'jpg')
+        file.seek(0)
+        name = self.storage.save(f'products/{uuid.uuid4().hex}/original.{extension}', file)
+        return self.resource(name).get_prep_value(), self.render(picture, os.path.dirname(name))
+
+    def derive(self, image):
+        with self.open_original(image) as file:
+            return self.render(self.open(file), os.path.dirname(image.public_id))
+
+    def open_original(self, image):
+        return self.storage.open(f'{image.public_id}.{image.format}' if image.format else image.public_id)
+
+    def open(self, file):
+        try:
+            picture = Image.open(file)
+            picture.load()
+        except (UnidentifiedImageError, OSError):
+            raise ValidationError('Upload a valid image.')
+        return picture
+
+    def render(self, picture, directory):
+        variants = {}
+        for name, spec in IMAGE_VARIANTS.items():
+            variant = picture.convert('RGB')
+            variant.thumbnail((spec['width'], spec['width'] * 4))
+            buffer = io.BytesIO()
+            variant.save(buffer, self.pil_formats[spec['format']], quality=85)
+            path = self.storage.save(f"{directory}/{name}.{spec['format']}", ContentFile(buffer.getvalue()))
+            variants[name] = {'url': self.storage.url(path), 'width': variant.width,
+                              'height': variant.height, 'format': spec['format']}
+        return variants
+
+    def resource(self, name):
+        public_id, _, extension = name.rpartition('.')
+        return CloudinaryResource(public_id=public_id, format=extension, type='upload', resource_type='image')
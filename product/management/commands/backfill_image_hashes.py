@@ -0,0 +1,42 @@
+from cloudinary.exceptions import Error as CloudinaryError
+from django.core.management.base import BaseCommand
+from product.images import get_image_backend, hash_file
+from product.models import ImageAsset, ProductImage
+
+
+class Command(BaseCommand):
+    help = ('Record the content hash of product images uploaded before they were hashed, '
+            'so new uploads of the same photo reuse them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        backend = get_image_backend()
+        images = ProductImage.objects.filter(content_hash='').order_by('pk').only('pk', 'image', 'variants')
+
+        hashed, failed, batch = 0, 0, []
+        for image in images.iterator(chunk_size=options['batch_size']):
+            try:
+                with backend.open_original(image.image) as file:
+                    image.content_hash = hash_file(file)
+            except (OSError, CloudinaryError) as error:
+                failed += 1
+                self.stderr.write(f'Image {image.pk} skipped: {error!r}')
+                continue
+            batch.append(image)
+            if len(batch) >= options['batch_size']:
+                hashed += self.save(batch)
+                batch = []
+        if batch:
+            hashed += self.save(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Hashed {hashed} images, {failed} failed'))
+
+    def save(self, batch):
+        # Hashes that already have an asset keep it
+        ImageAsset.objects.bulk_create([
+            ImageAsset(content_hash=image.content_hash, image=image.image, variants=image.variants)
+            for image in batch], ignore_conflicts=True)
+        return ProductImage.objects.bulk_update(batch, ['content_hash'])
+
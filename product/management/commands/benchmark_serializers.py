@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from product.fast_serializers import FastReadSerializer
+from product.models import Category, Product, Review
+from product.pricing import annotate_price_with_tax
+from product.serializers import CategorySerializer, ProductSerializer, ReviewSerializer
+
+
+class Command(BaseCommand):
+    help = ('Time ProductSerializer, CategorySerializer and ReviewSerializer against their '
+            'FastReadSerializer path on rows from the database, checking both render the same JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=200, help='Rows per serializer')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        limit, repeat = options['limit'], options['repeat']
+        cases = [
+            (ProductSerializer, annotate_price_with_tax(
+                Product.objects.defer('search_vector').prefetch_related('images'))),
+            (CategorySerializer, Category.objects.all()),
+            (ReviewSerializer, Review.objects.select_related('user')),
+        ]
+        renderer = JSONRenderer()
+        for serializer_class, queryset in cases:
+            rows = list(queryset[:limit])
+            if not rows:
+                self.stdout.write(f'{serializer_class.__name__}: no rows, skipped')
+                continue
+
+            drf_json = renderer.render(serializer_class(rows, many=True).data)
+            fast_json = renderer.render(FastReadSerializer(serializer_class, rows, many=True).data)
+            if drf_json != fast_json:
+                raise CommandError(f'{serializer_class.__name__}: fast path output differs')
+
+            drf = self.time(lambda: serializer_class(rows, many=True).data, repeat)
+            fast = self.time(lambda: FastReadSerializer(serializer_class, rows, many=True).data, repeat)
+            self.stdout.write(
+                f'{serializer_class.__name__}: {len(rows)} rows, '
+                f'DRF {drf * 1000:.2f} ms, fast {fast * 1000:.2f} ms, {drf / fast if fast else 0:.1f}x')
+
+    def time(self, serialize, repeat):
+        """Best of `repeat` runs, in seconds"""
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize()
+            best = min(best, time.perf_counter() - started)
+        return best
@@ -0,0 +1,38 @@
+from cloudinary.exceptions import Error as CloudinaryError
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from product.images import get_image_backend
+from product.models import Product, ProductImage
+from product.response_cache import invalidate
+
+
+class Command(BaseCommand):
+    help = 'Record the responsive variants of product images uploaded before they were generated'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--all', action='store_true', help='Rebuild images that already have variants')
+
+    def handle(self, *args, **options):
+        backend = get_image_backend()
+        images = ProductImage.objects.order_by('pk')
+        if not options['all']:
+            images = images.filter(variants={})
+
+        built, failed, product_ids = 0, 0, set()
+        for image in images.only('pk', 'product', 'image').iterator(chunk_size=options['batch_size']):
+            try:
+                variants = backend.derive(image.image)
+            except (ValidationError, OSError, CloudinaryError) as error:
+                failed += 1
+                self.stderr.write(f'Image {image.pk} skipped: {error!r}')
+                continue
+            ProductImage.objects.filter(pk=image.pk).update(variants=variants)
+            product_ids.add(image.product_id)
+            built += 1
+
+        if product_ids:
+            invalidate('productimage')
+            Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {built} images, {failed} failed'))
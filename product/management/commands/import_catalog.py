@@ -0,0 +1,214 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from product.models import Category, Product
+
+IMPORT_FIELDS = ['name', 'description', 'price', 'stock', 'category']
+# Checked per row with Model.clean_fields; the category is resolved separately
+VALIDATION_EXCLUDE = [field.name for field in Product._meta.fields if field.name not in ('name', 'price', 'stock')]
+
+
+def iter_json_lines(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """Yield the objects of a top level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    exhausted = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise CommandError('Expected a JSON array')
+            buffer = buffer[1:]
+            started = True
+            continue
+        if started:
+            buffer = buffer.lstrip(', \t\r\n')
+            if buffer.startswith(']'):
+                return
+            if buffer:
+                try:
+                    obj, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise CommandError('Truncated JSON array')
+                else:
+                    yield obj
+                    buffer = buffer[end:]
+                    continue
+
+        if exhausted:
+            raise CommandError('Truncated JSON array')
+        chunk = stream.read(chunk_size)
+        exhausted = not chunk
+        buffer += chunk
+
+
+def normalize(record):
+    # Accept `loaddata` fixture entries as well as flat rows
+    if 'fields' in record:
+        record = record['fields']
+    return record
+
+
+class Command(BaseCommand):
+    help = 'Stream products from a JSON array, JSON lines or CSV file into the catalog in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, e.g. fixtures/product_data.json')
+        parser.add_argument('--format', choices=['json', 'jsonl', 'csv'],
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--upsert-key', default='',
+                            help='Comma separated natural key, e.g. "name" or "name,category": '
+                                 'matching products are updated instead of inserted')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or self.detect_format(options['path'])
+        batch_size = options['batch_size']
+        self.upsert_key = [field.strip() for field in options['upsert_key'].split(',') if field.strip()]
+        unknown = set(self.upsert_key) - set(IMPORT_FIELDS)
+        if unknown:
+            raise CommandError(f"Unknown upsert key fields: {', '.join(sorted(unknown))}")
+
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.category_ids = set(self.categories.values())
+        totals = {'created': 0, 'updated': 0, 'skipped': 0}
+        started = time.monotonic()
+
+        with open(options['path'], newline='' if file_format == 'csv' else None, encoding='utf-8') as stream:
+            records = self.read(stream, file_format)
+            line = 0
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                products = []
+                for record in batch:
+                    line += 1
+                    product = self.build_product(normalize(record), line)
+                    if product is None:
+                        totals['skipped'] += 1
+                    else:
+                        products.append((line, product))
+
+                created, updated, skipped = self.write_batch(products)
+                totals['created'] += created
+                totals['updated'] += updated
+                totals['skipped'] += skipped
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{line} rows read')
+
+        elapsed = time.monotonic() - started
+        rows = totals['created'] + totals['updated']
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {rows} products ({totals['created']} created, {totals['updated']} updated, "
+            f"{totals['skipped']} skipped) in {elapsed:.1f}s, {rows / elapsed if elapsed else rows:.0f} rows/sec"))
+
+    def detect_format(self, path):
+        if path.endswith('.csv'):
+            return 'csv'
+        if path.endswith(('.jsonl', '.ndjson')):
+            return 'jsonl'
+        return 'json'
+
+    def read(self, stream, file_format):
+        if file_format == 'csv':
+            return iter(csv.DictReader(stream))
+        if file_format == 'jsonl':
+            return iter_json_lines(stream)
+        return iter_json_array(stream)
+
+    def build_product(self, record, line):
+        try:
+            price = Decimal(str(record['price']))
+            stock = int(record['stock'])
+            if price < 0 or stock < 0:
+                raise ValueError('negative price or stock')
+            product = Product(
+                name=record['name'],
+                description=record.get('description') or '',
+                price=price,
+                stock=stock,
+            )
+            # Lengths, digits and integer ranges, which the database would otherwise
+            # reject for the whole batch
+            product.clean_fields(exclude=VALIDATION_EXCLUDE)
+            product.category_id = self.resolve_category(record['category'])
+            return product
+        except ValidationError as error:
+            self.stderr.write(f'Row {line} skipped: {error.message_dict!r}')
+            return None
+        except (KeyError, ValueError, TypeError, InvalidOperation) as error:
+            self.stderr.write(f'Row {line} skipped: {error!r}')
+            return None
+
+    def resolve_category(self, value):
+        """Category ids are taken as is, names are looked up and created once"""
+        if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+            if int(value) not in self.category_ids:
+                raise ValueError(f'unknown category id {value}')
+            return int(value)
+        name = value.strip()
+        if name not in self.categories:
+            category = Category.objects.create(name=name)
+            self.categories[name] = category.pk
+            self.category_ids.add(category.pk)
+        return self.categories[name]
+
+    def natural_key(self, product):
+        return tuple(getattr(product, 'category_id' if field == 'category' else field)
+                     for field in self.upsert_key)
+
+    def write_batch(self, products):
+        """Write (line, product) pairs, returns how many were created, updated and skipped"""
+        if not products:
+            return 0, 0, 0
+
+        with transaction.atomic():
+            if not self.upsert_key:
+                Product.objects.bulk_create([product for _, product in products])
+                return len(products), 0, 0
+
+            # Like a later batch updating an earlier one, the last row with a key wins
+            incoming, lines = {}, {}
+            for line, product in products:
+                key = self.natural_key(product)
+                if key in incoming:
+                    self.stderr.write(f'Row {lines[key]} skipped: row {line} has the same upsert key {key!r}')
+                incoming[key], lines[key] = product, line
+            lookup = {f"{'category_id' if field == 'category' else field}__in":
+                      {key[index] for key in incoming} for index, field in enumerate(self.upsert_key)}
+            existing = {self.natural_key(product): product
+                        for product in Product.objects.filter(**lookup)}
+
+            to_create, to_update = [], []
+            now = timezone.now()
+            for key, product in incoming.items():
+                current = existing.get(key)
+                if current is None:
+                    to_create.append(product)
+                    continue
+                for field in IMPORT_FIELDS:
+                    attname = 'category_id' if field == 'category' else field
+                    setattr(current, attname, getattr(product, attname))
+                current.updated_at = now
+                to_update.append(current)
+
+            Product.objects.bulk_create(to_create)
+            Product.objects.bulk_update(to_update, IMPORT_FIELDS + ['updated_at'])
+            return len(to_create), len(to_update), len(products) - len(incoming)
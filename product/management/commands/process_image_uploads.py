@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from product.image_queue import STALE_AFTER, process_pending
+from product.models import ProductImageUpload
+
+
+class Command(BaseCommand):
+    help = ('Store the product image uploads that are due, retries included. Run it from cron or a '
+            'scheduler; each upload gets one attempt per run')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=int(STALE_AFTER.total_seconds() // 60),
+                            help='Minutes after which an upload still processing is retried')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Process at most this many uploads')
+
+    def handle(self, *args, **options):
+        requeued, processed = process_pending(
+            limit=options['limit'], stale_after=timedelta(minutes=options['stale_after']))
+
+        counts = dict.fromkeys(status for status, _ in ProductImageUpload.STATUS_CHOICES)
+        for status in counts:
+            counts[status] = ProductImageUpload.objects.filter(status=status).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Requeued {requeued} stale uploads, processed {processed}; '
+            + ', '.join(f'{count} {status}' for status, count in counts.items())))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from product.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute review_count, rating_sum, avg_rating and the star histogram of products from their reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int,
+                            help='Only rebuild these products (default: all)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # Batches commit one by one, see rebuild_ratings
+        written = rebuild_ratings(
+            product_ids=options['product_ids'] or None,
+            batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rating aggregates for {written} products'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from product.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recount products per category and fix any drifted Category.product_count'
+
+    def handle(self, *args, **options):
+        fixed = Category.objects.reconcile_product_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed product_count on {fixed} categories'))
@@ -1,28 +0,0 @@
-# Generated by Django 5.1.5 on 2025-01-26 09:20
-
-import django.db.models.deletion
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('product', '0001_initial'),
-    ]
-
-    operations = [
-        migrations.AlterModelOptions(
-            name='product',
-            options={'ordering': ['-id']},
-        ),
-        migrations.CreateModel(
-            name='Review',
-            fields=[
-                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
-                ('name', models.CharField(max_length=255)),
-                ('description', models.TextField()),
-                ('date', models.DateField(auto_now_add=True)),
-                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.product')),
-            ],
-        ),
-    ]
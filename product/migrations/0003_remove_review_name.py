@@ -1,17 +0,0 @@
-# Generated by Django 5.1.5 on 2025-02-02 15:09
-
-from django.db import migrations
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('product', '0002_alter_product_options_review'),
-    ]
-
-    operations = [
-        migrations.RemoveField(
-            model_name='review',
-            name='name',
-        ),
-    ]
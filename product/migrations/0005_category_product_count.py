@@ -0,0 +1,29 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:26
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    Category = apps.get_model('product', 'Category')
+    Product = apps.get_model('product', 'Product')
+    Category.objects.update(product_count=Coalesce(models.Subquery(
+        Product.objects.filter(category=models.OuterRef('pk')).order_by().values(
+            'category').annotate(count=models.Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
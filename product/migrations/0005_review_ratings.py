@@ -1,20 +0,0 @@
-# Generated by Django 5.1.5 on 2025-02-02 15:15
-
-import django.core.validators
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('product', '0004_review_user'),
-    ]
-
-    operations = [
-        migrations.AddField(
-            model_name='review',
-            name='ratings',
-            field=models.PositiveIntegerField(default=5, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
-            preserve_default=False,
-        ),
-    ]
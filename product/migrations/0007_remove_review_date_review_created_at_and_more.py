@@ -1,29 +0,0 @@
-# Generated by Django 5.1.5 on 2025-02-02 15:18
-
-import django.utils.timezone
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('product', '0006_rename_description_review_comment'),
-    ]
-
-    operations = [
-        migrations.RemoveField(
-            model_name='review',
-            name='date',
-        ),
-        migrations.AddField(
-            model_name='review',
-            name='created_at',
-            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
-            preserve_default=False,
-        ),
-        migrations.AddField(
-            model_name='review',
-            name='updated_at',
-            field=models.DateTimeField(auto_now=True),
-        ),
-    ]
@@ -1,35 +0,0 @@
-# Generated by Django 5.1.5 on 2025-03-13 06:04
-
-import cloudinary.models
-import django.db.models.deletion
-import product.validators
-from django.conf import settings
-from django.db import migrations, models
-
-
-class Migration(migrations.Migration):
-
-    dependencies = [
-        ('product', '0009_productimage'),
-        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
-    ]
-
-    operations = [
-        migrations.AlterField(
-            model_name='productimage',
-            name='image',
-            field=cloudinary.models.CloudinaryField(max_length=255, validators=[product.validators.validate_file_size], verbose_name='image'),
-        ),
-        migrations.CreateModel(
-            name='Wishlist',
-            fields=[
-                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
-                ('created_at', models.DateTimeField(auto_now_add=True)),
-                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.product')),
-                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
-            ],
-            options={
-                'unique_together': {('user', 'product')},
-            },
-        ),
-    ]
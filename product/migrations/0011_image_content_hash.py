@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0010_productimageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='productimageupload',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
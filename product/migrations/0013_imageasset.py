@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:24
+
+import cloudinary.models
+from django.db import migrations, models
+
+
+def create_assets(apps, schema_editor):
+    """One asset per hash already recorded, from the oldest image with it"""
+    ProductImage = apps.get_model('product', 'ProductImage')
+    ImageAsset = apps.get_model('product', 'ImageAsset')
+    images = ProductImage.objects.exclude(content_hash='').order_by('pk').values_list(
+        'content_hash', 'image', 'variants')
+    assets = {}
+    for content_hash, image, variants in images.iterator(chunk_size=2000):
+        assets.setdefault(content_hash, ImageAsset(content_hash=content_hash, image=image, variants=variants))
+    ImageAsset.objects.bulk_create(assets.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0012_review_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('image', cloudinary.models.CloudinaryField(max_length=255, verbose_name='image')),
+                ('variants', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(create_assets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0013_imageasset'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productimageupload',
+            name='imageupload_status_idx',
+        ),
+        migrations.AddField(
+            model_name='productimageupload',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='productimageupload',
+            name='replaces_image',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='productimageupload',
+            name='image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='uploads', to='product.productimage'),
+        ),
+        migrations.AddIndex(
+            model_name='productimageupload',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='imageupload_due_idx'),
+        ),
+    ]
@@ -1,53 +1,362 @@
-from django.db import models
+from collections import Counter
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from product.validators import validate_file_size
+from product.response_cache import invalidate
+from product.search import SEARCH_WEIGHTS, catalog_index, uses_database_search
 from cloudinary.models import CloudinaryField
 
 
-class Category(models.Model):
+class CounterCacheModel(models.Model):
+    """Fields listed in `counter_fields` are only written with F() updates, a full save() leaves them alone"""
+    counter_fields = []
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+class CategoryQuerySet(models.QuerySet):
+    def adjust_product_counts(self, deltas):
+        """Apply {category_id: delta}, locking rows in id order so concurrent writers don't deadlock"""
+        for category_id, delta in sorted(deltas.items()):
+            if delta:
+                self.filter(pk=category_id).update(
+                    product_count=models.F('product_count') + delta, updated_at=timezone.now())
+        invalidate('category')
+
+    def reconcile_product_counts(self):
+        """Recount products for categories whose cached count drifted, returns how many were fixed"""
+        actual = Coalesce(models.Subquery(
+            Product.objects.filter(category=models.OuterRef('pk')).order_by().values(
+                'category').annotate(count=models.Count('pk')).values('count')
+        ), 0)
+        drifted = self.annotate(actual_count=actual).exclude(
+            product_count=models.F('actual_count'))
+        fixed = self.filter(pk__in=drifted.values('pk')).update(
+            product_count=actual, updated_at=timezone.now())
+        # After the write, see ProductQuerySet
+        invalidate('category')
+        return fixed
+
+
+DEFAULT_TAX_RATE = Decimal('0.10')
+
+
+class Category(CounterCacheModel):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
+    # Fraction added on top of the price, see product.pricing
+    tax_rate = models.DecimalField(
+        max_digits=5, decimal_places=4, default=DEFAULT_TAX_RATE,
+        validators=[MinValueValidator(Decimal('0')), MaxValueValidator(Decimal('1'))])
+    updated_at = models.DateTimeField(auto_now=True)
+    # Kept in step by Product.save/delete and ProductQuerySet bulk operations
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ['product_count']
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
-class Product(models.Model):
+class ProductQuerySet(models.QuerySet):
+    """
+    Bulk writes bypass Product.save/delete and its signals, so they keep
+    Category.product_count right, invalidate cached catalog responses and
+    refresh the in-process search index here. They invalidate once the write is
+    done: under autocommit on_commit runs at once, and bumping first would let a
+    concurrent read cache the old rows under the new generation.
+    """
+
+    def bulk_create(self, objs, batch_size=None, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            # Upserted rows may move out of their current category
+            moved_from = self._categories_matching(objs, kwargs['unique_fields']) if kwargs.get(
+                'update_conflicts') and kwargs.get('unique_fields') else set()
+            created = super().bulk_create(objs, batch_size=batch_size, **kwargs)
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # Skipped or upserted rows don't tell us what was inserted, recount instead
+                Category.objects.filter(
+                    pk__in={obj.category_id for obj in created} | moved_from).reconcile_product_counts()
+            else:
+                Category.objects.adjust_product_counts(
+                    Counter(obj.category_id for obj in created))
+            invalidate('product')
+            self._reindex()
+        return created
+
+    def update(self, **kwargs):
+        field = 'category_id' if 'category_id' in kwargs else 'category'
+        if field not in kwargs:
+            # A single statement, already committed under autocommit
+            rows = super().update(**kwargs)
+            invalidate('product')
+            if SEARCH_WEIGHTS.keys() & kwargs.keys():
+                self._reindex()
+            return rows
+
+        value = kwargs[field]
+        with transaction.atomic(using=self.db):
+            if hasattr(value, 'resolve_expression'):
+                # e.g. the Case() built by bulk_update, read the new categories back
+                moved = self.model.objects.filter(
+                    pk__in=list(self.values_list('pk', flat=True)))
+                deltas = moved._counts_by_category(sign=-1)
+                rows = super().update(**kwargs)
+                deltas.update(moved._counts_by_category(sign=1))
+            else:
+                deltas = self._counts_by_category(sign=-1)
+                rows = super().update(**kwargs)
+                deltas[getattr(value, 'pk', value)] += rows
+            Category.objects.adjust_product_counts(deltas)
+            invalidate('product')
+            if SEARCH_WEIGHTS.keys() & kwargs.keys():
+                self._reindex()
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            deltas = self._counts_by_category(sign=-1)
+            result = super().delete()
+            Category.objects.adjust_product_counts(deltas)
+            invalidate('product')
+            self._reindex()
+        return result
+
+    def decrement_stock(self, quantities):
+        """
+        Take {product_id: quantity} off the stock in one UPDATE that only
+        touches products which still have enough. Returns whether all did;
+        callers roll back their transaction when not.
+        """
+        enough = models.Q()
+        for product_id, quantity in quantities.items():
+            enough |= models.Q(pk=product_id, stock__gte=quantity)
+        rows = self.filter(enough).update(
+            stock=models.Case(
+                *[models.When(pk=product_id, then=models.F('stock') - quantity)
+                  for product_id, quantity in sorted(quantities.items())],
+                default=models.F('stock'), output_field=self.model._meta.get_field('stock')),
+            updated_at=timezone.now())
+        return rows == len(quantities)
+
+    def _reindex(self):
+        """The SQLite search index can't follow bulk writes, rebuild it once they commit"""
+        if not uses_database_search():
+            transaction.on_commit(catalog_index.reset, using=self.db)
+
+    def _categories_matching(self, objs, unique_fields):
+        """Categories of the stored products that `objs` match on `unique_fields`"""
+        opts = self.model._meta
+        attnames = [opts.pk.attname if name == 'pk' else opts.get_field(name).attname for name in unique_fields]
+        match = models.Q()
+        for obj in objs:
+            values = {attname: getattr(obj, attname) for attname in attnames}
+            if None not in values.values():
+                match |= models.Q(**values)
+        if not match:
+            return set()
+        return set(self.model.objects.filter(match).values_list('category_id', flat=True).distinct())
+
+    def _counts_by_category(self, sign):
+        rows = self.order_by().values('category_id').annotate(count=models.Count('pk'))
+        return Counter({row['category_id']: sign * row['count'] for row in rows})
+
+
+class Product(CounterCacheModel):
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
+    # Covered by the (category, price) index
     category = models.ForeignKey(
-        Category, on_delete=models.CASCADE, related_name="products")
+        Category, on_delete=models.CASCADE, related_name="products", db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted name/description tsvector, maintained by a database trigger on Postgres
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Review aggregates, only ever written with F() updates by product.ratings
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    avg_rating = models.DecimalField(
+        max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    RATING_COUNT_FIELDS = {rating: f'rating_{rating}_count' for rating in range(1, 6)}
+    RATING_FIELDS = ['review_count', 'rating_sum', 'avg_rating',
+                     *RATING_COUNT_FIELDS.values()]
+    counter_fields = RATING_FIELDS
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ['-id',]
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            # ProductFilter: category with a price range, or sorted by price within a category
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            # ?ordering=updated_at and its keyset pages, pk as the tie-breaker
+            models.Index(fields=['updated_at', 'id'], name='product_updated_id_idx'),
+            # The `latest` action
+            models.Index(fields=['created_at'], name='product_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic(using=kwargs.get('using')):
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                Category.objects.adjust_product_counts({self.category_id: 1})
+            elif update_fields is not None and not {'category', 'category_id'} & set(update_fields):
+                super().save(*args, **kwargs)
+            else:
+                old_category_id = getattr(self, '_loaded_category_id', None)
+                if old_category_id is None:
+                    old_category_id = Product.objects.filter(
+                        pk=self.pk).values_list('category_id', flat=True).first()
+                super().save(*args, **kwargs)
+                if old_category_id != self.category_id:
+                    Category.objects.adjust_product_counts(
+                        {old_category_id: -1, self.category_id: 1})
+        self._loaded_category_id = self.category_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            result = super().delete(*args, **kwargs)
+            # Nothing to take off when another request deleted the row first
+            deleted = result[1].get(self._meta.label, 0)
+            Category.objects.adjust_product_counts({self.category_id: -deleted})
+        return result
+
+    @property
+    def rating_histogram(self):
+        return {rating: getattr(self, field)
+                for rating, field in self.RATING_COUNT_FIELDS.items()}
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name='images')
     image = CloudinaryField('image', validators=[validate_file_size])
+    # {name: {url, width, height, format}} for product.images.IMAGE_VARIANTS, written on upload
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    # sha256 of the uploaded file, images with the same content share one ImageAsset
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
     # file = models.FileField(upload_to="product/files",
     #                         validators=FileExtensionValidator(['pdf']))
 
 
+class ImageAsset(models.Model):
+    """
+    The one stored upload for each distinct image content, copied onto every
+    ProductImage with that content_hash (product.images.store_or_reuse). The
+    unique hash makes concurrent uploads of the same file settle on one asset.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    image = CloudinaryField('image')
+    variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ProductImageUpload(models.Model):
+    """
+    An image file staged on shared storage and waiting for the upload queue
+    (product.image_queue) to validate and store it as a new ProductImage, or
+    as the new file of `image` when `replaces_image` is set.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='image_uploads')
+    # Path in the staging storage, cleared once the file is stored or given up on
+    staged_file = models.CharField(max_length=255, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Pending uploads are picked up from then on, later for a retry
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    image = models.ForeignKey(
+        ProductImage, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploads')
+    replaces_image = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # The queue's backlog, due first
+            models.Index(fields=['status', 'next_attempt_at'], name='imageupload_due_idx'),
+        ]
+
+
+class StagedFile(models.Model):
+    """Content of a file staged by product.image_queue.DatabaseStagingStorage"""
+    name = models.CharField(max_length=255, unique=True)
+    content = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class Review(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Covered by the (product, created_at) index
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    # Covered by the (user, created_at) index
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     ratings = models.PositiveIntegerField(
         validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A product's reviews, newest first
+            models.Index(fields=['product', 'created_at'], name='review_product_created_idx'),
+            # ?ordering=ratings / -ratings within a product
+            models.Index(fields=['product', 'ratings', 'id'], name='review_product_ratings_idx'),
+            # my_reviews, newest first
+            models.Index(fields=['user', 'created_at'], name='review_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"Review by {self.user.first_name} on {self.product.name}"
 class Wishlist(models.Model):
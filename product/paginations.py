@@ -1,5 +1,168 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode
+from urllib import parse
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination, Cursor
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+class ReviewPagination(PageNumberPagination):
+    """Clients may ask for bigger pages with `?page_size=`, never more than max_page_size"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset pagination on the view's ordering plus the primary key as tie-breaker.
+    The cursor stores the whole sort key of the boundary row, so each page is a
+    range scan from that key: no COUNT query and no OFFSET, deep pages cost the
+    same as the first one.
+    """
+    page_size = 10
+    ordering = '-id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = [_invert(field) for field in self.ordering] if reverse else list(self.ordering)
+
+        try:
+            if self.cursor is not None:
+                if len(self.cursor.position) != len(ordering):
+                    raise NotFound(self.invalid_cursor_message)
+                queryset = _filter(queryset, _keyset_filter(ordering, self.cursor.position))
+            results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        except (ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+
+        ordering = (ordering or getattr(view, 'ordering', None)
+                    or queryset.model._meta.ordering or self.ordering)
+        if isinstance(ordering, str):
+            ordering = [ordering]
+
+        pk_name = queryset.model._meta.pk.name
+        ordering = [field.replace('pk', pk_name) if field.lstrip('-') == 'pk' else field
+                    for field in ordering]
+        assert not any('__' in field for field in ordering), (
+            'Keyset pagination only supports ordering on fields of the model itself.'
+        )
+
+        if pk_name not in [field.lstrip('-') for field in ordering]:
+            direction = '-' if ordering[0].startswith('-') else ''
+            ordering.append(direction + pk_name)
+        return tuple(ordering)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    def _get_position_from_instance(self, instance, ordering):
+        fields = [field.lstrip('-') for field in ordering]
+        if isinstance(instance, dict):
+            return [str(instance[field]) for field in fields]
+        return [str(instance.serializable_value(field)) for field in fields]
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in keyset pages for a viewset: clients ask for them with
+    `?pagination=cursor` and then follow the `next`/`previous` links.
+    Without it the view keeps its regular `pagination_class`.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.wants_keyset_pagination():
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
+
+    def wants_keyset_pagination(self):
+        params = self.request.query_params
+        cursor_param = self.keyset_pagination_class.cursor_query_param
+        return params.get('pagination') == 'cursor' or cursor_param in params
+
+
+def _invert(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+def _keyset_filter(ordering, position):
+    """(a, b, id) > (x, y, z) spelled out per column so mixed directions work"""
+    condition = Q()
+    for index, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f"{field.lstrip('-')}__{lookup}": position[index]})
+        for previous, value in zip(ordering[:index], position):
+            clause &= Q(**{previous.lstrip('-'): value})
+        condition |= clause
+    return condition
+
+
+def _filter(queryset, condition):
+    """queryset.filter(condition); Django can't filter a union, so each of its parts is filtered instead"""
+    if not queryset.query.combinator:
+        return queryset.filter(condition)
+    filtered = queryset._chain()
+    filtered.query.combined_queries = tuple(
+        QuerySet(model=part.model, query=part.chain()).filter(condition).query
+        for part in queryset.query.combined_queries)
+    return filtered
+
@@ -0,0 +1,50 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Round
+from product.models import Category, DEFAULT_TAX_RATE
+from product.response_cache import get_cache, get_generations
+
+TAX_RATES_KEY = 'catalog:tax-rates:{}'
+CENT = Decimal('0.01')
+
+
+def tax_rates():
+    """
+    {category_id: rate} for the categories that don't use DEFAULT_TAX_RATE.
+    Read from the catalog cache, keyed by the category generation so a saved
+    category is picked up on the next request.
+    """
+    generation, = get_generations(['category'])
+    key = TAX_RATES_KEY.format(generation)
+    rates = get_cache().get(key)
+    if rates is None:
+        rates = dict(Category.objects.exclude(tax_rate=DEFAULT_TAX_RATE).values_list('pk', 'tax_rate'))
+        get_cache().set(key, rates, timeout=None)
+    return rates
+
+
+def price_with_tax(price, category_id, rates=None):
+    """Python counterpart of the annotation for rows that weren't loaded through it"""
+    rate = (tax_rates() if rates is None else rates).get(category_id, DEFAULT_TAX_RATE)
+    return (price * (1 + rate)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def price_with_tax_expression(rates=None, prefix=''):
+    """
+    The price of the product at `prefix` (e.g. 'product__') with its category's
+    tax, rounded to cents by the database
+    """
+    rates = tax_rates() if rates is None else rates
+    output_field = DecimalField(max_digits=12, decimal_places=4)
+    multiplier = Value(1 + DEFAULT_TAX_RATE, output_field=output_field)
+    if rates:
+        multiplier = Case(
+            *[When(**{f'{prefix}category_id': category_id}, then=Value(1 + rate, output_field=output_field))
+              for category_id, rate in sorted(rates.items())],
+            default=multiplier, output_field=output_field)
+    return Round(F(f'{prefix}price') * multiplier, 2, output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def annotate_price_with_tax(queryset, rates=None):
+    """Annotate `price_with_tax`, rounded to cents by the database so it can be filtered and sorted on"""
+    return queryset.annotate(price_with_tax=price_with_tax_expression(rates))
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import F, Q, OuterRef, Subquery, Value, Count, Sum, DecimalField, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from django.utils import timezone
+from product.models import Product, Review
+
+AVG_RATING_FIELD = DecimalField(max_digits=3, decimal_places=2)
+
+
+def average_rating(rating_sum, review_count):
+    """
+    rating_sum / review_count rounded half away from zero to two places by the
+    database, 0 without reviews. Live updates and rebuilds share it so they agree.
+    """
+    return Coalesce(
+        Round(Cast(rating_sum, FloatField()) / NullIf(review_count, Value(0)), 2),
+        Value(0.0), output_field=AVG_RATING_FIELD)
+
+
+def apply_rating_change(product_id, added=None, removed=None):
+    """
+    Fold one review change into the product's aggregates with a single UPDATE.
+    `added` is the new rating (create/update), `removed` the old one (update/delete).
+    All right-hand sides read the pre-update row, so concurrent writers can't lose counts.
+    """
+    if added == removed:
+        return
+
+    count_delta = (added is not None) - (removed is not None)
+    sum_delta = (added or 0) - (removed or 0)
+    count_fields = Product.RATING_COUNT_FIELDS
+
+    updates = {
+        'updated_at': timezone.now(),
+        'review_count': F('review_count') + count_delta,
+        'rating_sum': F('rating_sum') + sum_delta,
+        'avg_rating': average_rating(F('rating_sum') + sum_delta, F('review_count') + count_delta),
+    }
+    if added is not None:
+        updates[count_fields[added]] = F(count_fields[added]) + 1
+    if removed is not None:
+        updates[count_fields[removed]] = F(count_fields[removed]) - 1
+
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def rebuild_ratings(product_ids=None, batch_size=1000):
+    """
+    Recompute the aggregates from the reviews table, returns the number of
+    products written. Each batch is locked and then written with one UPDATE
+    from the review aggregates, so a rating change either lands before it and
+    is counted, or waits and applies its delta on top; none is overwritten.
+    """
+    products = Product.objects.order_by('pk')
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+    def aggregate(expression):
+        return Coalesce(Subquery(reviews.annotate(value=expression).values('value')), 0)
+
+    review_count, rating_sum = aggregate(Count('id')), aggregate(Sum('ratings'))
+    updates = {
+        'review_count': review_count,
+        'rating_sum': rating_sum,
+        'avg_rating': average_rating(rating_sum, review_count),
+        **{field: aggregate(Count('id', filter=Q(ratings=rating)))
+           for rating, field in Product.RATING_COUNT_FIELDS.items()},
+    }
+
+    written = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(products.filter(pk__gt=last_pk).select_for_update().values_list(
+                'pk', flat=True)[:batch_size])
+            if not batch:
+                return written
+            Product.objects.filter(pk__in=batch).update(**updates)
+        last_pk = batch[-1]
+        written += len(batch)
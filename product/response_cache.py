@@ -0,0 +1,121 @@
+import hashlib
+import time
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+CACHE_ALIAS = 'catalog'
+GENERATION_KEY = 'catalog:generation:{}'
+STATS_KEYS = {'hit': 'catalog:stats:hits', 'miss': 'catalog:stats:misses'}
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Vary', 'Allow')
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _new_generation():
+    # Time based, so a generation key that got evicted never comes back as a value already used
+    return int(time.time() * 1000)
+
+
+def get_generations(names):
+    cache = get_cache()
+    keys = [GENERATION_KEY.format(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_generation(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump_generation(*names):
+    cache = get_cache()
+    for name in names:
+        key = GENERATION_KEY.format(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), timeout=None)
+
+
+def invalidate(*names):
+    """Bump the generations once the current transaction commits, so readers can't re-cache old rows"""
+    transaction.on_commit(lambda: bump_generation(*names))
+
+
+def record(outcome):
+    cache = get_cache()
+    try:
+        cache.incr(STATS_KEYS[outcome])
+    except ValueError:
+        cache.add(STATS_KEYS[outcome], 0, timeout=None)
+        cache.incr(STATS_KEYS[outcome])
+
+
+def cache_stats():
+    values = get_cache().get_many(STATS_KEYS.values())
+    hits = values.get(STATS_KEYS['hit'], 0)
+    misses = values.get(STATS_KEYS['miss'], 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None}
+
+
+class CachedResponseMixin:
+    """
+    Serve anonymous JSON GETs of `cached_actions` from the catalog cache.
+    The key is the path, the sorted query params and the current generation of
+    every model in `cache_dependencies`; saving or deleting one of those models
+    bumps its generation so older entries are simply never read again.
+    """
+    cached_actions = ('list', 'retrieve')
+    cache_dependencies = ()
+    cache_timeout = DEFAULT_TIMEOUT
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cached = get_cache().get(key)
+        if cached is not None:
+            record('hit')
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers.items():
+                response[header] = value
+            response['X-Cache'] = 'HIT'
+            # Validators were stored with the entry, so a revalidating client still gets its 304
+            return get_conditional_response(
+                request, etag=headers.get('ETag'),
+                last_modified=parse_http_date_safe(headers.get('Last-Modified')),
+                response=response)
+
+        record('miss')
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and getattr(
+                response, 'accepted_media_type', '').startswith('application/json'):
+            response.render()
+            headers = {header: response[header]
+                       for header in CACHED_HEADERS if response.has_header(header)}
+            get_cache().set(key, (response.content, headers), timeout=self.cache_timeout)
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def get_response_cache_key(self, request):
+        action = getattr(self, 'action_map', {}).get(request.method.lower())
+        if (request.method != 'GET' or action not in self.cached_actions
+                or 'HTTP_AUTHORIZATION' in request.META
+                or 'text/html' in request.META.get('HTTP_ACCEPT', '')
+                or request.GET.get('format') == 'api'):
+            return None
+
+        params = sorted((name, sorted(values)) for name, values in request.GET.lists())
+        generations = get_generations(self.cache_dependencies)
+        raw = f"{request.path}|{params}|{generations}"
+        return 'catalog:response:' + hashlib.md5(raw.encode()).hexdigest()
@@ -0,0 +1,135 @@
+import math
+import re
+import threading
+from collections import defaultdict, Counter
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, When, FloatField, Value
+
+SEARCH_CONFIG = 'english'
+
+# Same fields and weights as the product_product search_vector trigger
+SEARCH_WEIGHTS = {'name': 'A', 'description': 'B'}
+
+# Postgres' default ts_rank weights for D, C, B, A
+RANK_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the to with'.split())
+
+
+def tokenize(text):
+    """Lowercase, drop stopwords and fold simple plurals, a small stand-in for the english tsearch config"""
+    tokens = []
+    for word in re.findall(r'\w+', (text or '').lower()):
+        if word in STOPWORDS:
+            continue
+        if word.endswith("s") and len(word) > 3 and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class InvertedIndex:
+    """
+    In-process term -> {product_id: weighted term frequency} index used when the
+    database has no full-text search (SQLite dev and test runs). It is built
+    lazily from the products table and kept current by product signals.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.postings = defaultdict(dict)
+            self.documents = {}
+            self.built = False
+
+    def build(self, queryset):
+        with self._lock:
+            if self.built:
+                return
+            for row in queryset.values('id', *SEARCH_WEIGHTS).iterator(chunk_size=2000):
+                self._add(row['id'], row)
+            self.built = True
+
+    def update(self, product):
+        if not self.built:
+            return
+        with self._lock:
+            self._remove(product.pk)
+            self._add(product.pk, {field: getattr(product, field)
+                                   for field in SEARCH_WEIGHTS})
+
+    def remove(self, product_id):
+        if not self.built:
+            return
+        with self._lock:
+            self._remove(product_id)
+
+    def search(self, query):
+        """Return {product_id: score} for products containing every query term"""
+        terms = tokenize(query)
+        if not terms:
+            return {}
+
+        with self._lock:
+            postings = [self.postings.get(term, {}) for term in terms]
+            total = len(self.documents) or 1
+        if not all(postings):
+            return {}
+
+        matches = set.intersection(*(set(posting) for posting in postings))
+        scores = {}
+        for product_id in matches:
+            score = 0.0
+            for posting in postings:
+                idf = math.log(1 + total / len(posting))
+                score += posting[product_id] * idf
+            scores[product_id] = score
+        return scores
+
+    def _add(self, product_id, values):
+        frequencies = Counter()
+        for field, weight in SEARCH_WEIGHTS.items():
+            for term in tokenize(values[field]):
+                frequencies[term] += RANK_WEIGHTS[weight]
+        for term, frequency in frequencies.items():
+            self.postings[term][product_id] = frequency
+        self.documents[product_id] = tuple(frequencies)
+
+    def _remove(self, product_id):
+        for term in self.documents.pop(product_id, ()):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(product_id, None)
+                if not posting:
+                    del self.postings[term]
+
+
+catalog_index = InvertedIndex()
+
+
+def uses_database_search():
+    return connection.vendor == 'postgresql'
+
+
+def search_products(queryset, query):
+    """Filter to products matching `query` and annotate a `search_rank`, best match first"""
+    if uses_database_search():
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank('search_vector', search_query)
+        ).order_by('-search_rank', '-id')
+
+    catalog_index.build(queryset.model.objects.all())
+    scores = catalog_index.search(query)
+    if not scores:
+        return queryset.none()
+    return queryset.filter(pk__in=scores).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+            output_field=FloatField())
+    ).order_by('-search_rank', '-id')
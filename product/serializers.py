@@ -1,37 +1,152 @@
 from rest_framework import serializers
-from decimal import Decimal
-from product.models import Category, Product, Review, ProductImage, Wishlist
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from django.utils.functional import cached_property
+from product.models import Category, Product, Review, ProductImage, ProductImageUpload, Wishlist
+from product.pricing import price_with_tax, tax_rates
+from product.fieldsets import SparseFieldsetMixin
+from product.image_queue import stage_upload
+from product.validators import validate_file_size
 from django.contrib.auth import get_user_model
 
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'product_count']
+        fields = ['id', 'name', 'description', 'tax_rate', 'product_count']
 
     product_count = serializers.IntegerField(
         read_only=True, help_text="Return the number product in this category")
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Files are only written through the upload queue, see ProductImageUploadSerializer"""
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
+        read_only_fields = ['image']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductImageUploadSerializer(serializers.ModelSerializer):
+    """
+    A new product image, or a new file for an image when saved with `replaces`:
+    the file is staged and stored by the upload queue, see `status`
+    """
+    image = serializers.FileField(write_only=True, validators=[validate_file_size])
+    product_image = ProductImageSerializer(source='image', read_only=True)
+
+    class Meta:
+        model = ProductImageUpload
+        fields = ['id', 'image', 'status', 'attempts', 'error', 'product_image', 'replaces_image',
+                  'created_at', 'updated_at']
+        read_only_fields = ['status', 'attempts', 'error', 'replaces_image', 'created_at', 'updated_at']
+
+    def create(self, validated_data):
+        return stage_upload(validated_data['product_id'], validated_data['image'],
+                            replaces=validated_data.get('replaces'))
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Resolve the pk from objects the bulk list serializer loaded up front, query only on a miss"""
+
+    def to_internal_value(self, data):
+        preloaded = getattr(self.root, 'preloaded', {}).get(self.source, {})
+        try:
+            return preloaded[int(data)]
+        except (KeyError, TypeError, ValueError):
+            return super().to_internal_value(data)
+
+
+class ProductListSerializer(serializers.ListSerializer):
+    """
+    Bulk create and update for ProductSerializer(many=True). Items are
+    validated by the regular child serializer in one pass with categories
+    loaded in a single query, then written with batched bulk_create/bulk_update.
+    Updates match items to `instance` by their `id`.
+    """
+    batch_size = 500
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            items = [item for item in data if isinstance(item, dict)]
+            category_ids = {str(item['category']) for item in items if 'category' in item}
+            self.preloaded = {'category': Category.objects.in_bulk(
+                [int(pk) for pk in category_ids if pk.isdigit()])}
+            if self.instance is not None:
+                self.instances_by_id = {product.pk: product for product in self.instance}
+                self.update_targets = []
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return super().run_child_validation(data)
+
+        product = self.instances_by_id.get(data.get('id')) if isinstance(data, dict) else None
+        if product is None:
+            raise serializers.ValidationError({'id': ['Unknown or missing product id.']})
+        self.child.instance = product
+        self.child.initial_data = data
+        validated = super().run_child_validation(data)
+        self.update_targets.append(product)
+        return validated
+
+    def create(self, validated_data):
+        products = [Product(**attrs) for attrs in validated_data]
+        Product.objects.bulk_create(products, batch_size=self.batch_size)
+        prefetch_related_objects(products, 'images')
+        return products
+
+    def update(self, instance, validated_data):
+        fields = {'updated_at'}
+        now = timezone.now()
+        for product, attrs in zip(self.update_targets, validated_data):
+            for attr, value in attrs.items():
+                setattr(product, attr, value)
+            product.updated_at = now
+            fields.update(attrs)
+        Product.objects.bulk_update(self.update_targets, sorted(fields), batch_size=self.batch_size)
+        return self.update_targets
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+    # Columns behind the fields that aren't model fields, for product.fieldsets.trim_queryset
+    field_columns = {
+        'price_with_tax': ['price', 'category'],
+        'rating_histogram': list(Product.RATING_COUNT_FIELDS.values()),
+    }
 
     class Meta:
         model = Product
+        list_serializer_class = ProductListSerializer
         fields = ['id', 'name', 'description', 'price',
-                  'stock', 'category', 'price_with_tax', 'images']  # other
+                  'stock', 'category', 'price_with_tax', 'images',
+                  'review_count', 'avg_rating', 'rating_histogram', 'in_wishlist']  # other
 
     price_with_tax = serializers.SerializerMethodField(
-        method_name='calculate_tax')
-
-    def calculate_tax(self, product):
-        return round(product.price * Decimal(1.1), 2)
+        help_text="Price including the category's tax rate")
+    rating_histogram = serializers.DictField(
+        child=serializers.IntegerField(), read_only=True,
+        help_text="Number of reviews per star rating, 1 to 5")
+    # Only rendered with the `with_wishlist` context, where product.wishlist annotated it
+    in_wishlist = serializers.BooleanField(read_only=True)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('with_wishlist'):
+            fields.pop('in_wishlist', None)
+        return fields
+
+    @cached_property
+    def category_tax_rates(self):
+        return tax_rates()
+
+    def get_price_with_tax(self, product):
+        # Annotated by product.pricing on catalog querysets
+        if hasattr(product, 'price_with_tax'):
+            return product.price_with_tax
+        return price_with_tax(product.price, product.category_id, self.category_tax_rates)
 
     def validate_price(self, price):
         if price < 0:
@@ -52,23 +167,20 @@ class SimpleUserSerializer(serializers.ModelSerializer):
 
 
 class ReviewSerializer(serializers.ModelSerializer):
-    # user = SimpleUserSerializer()
-    user = serializers.SerializerMethodField(method_name='get_user')
+    # Reads expect the user to be selected with the review
+    user = SimpleUserSerializer(read_only=True)
 
     class Meta:
         model = Review
         fields = ['id', 'user', 'product', 'ratings', 'comment']
         read_only_fields = ['user', 'product']
 
-    def get_user(self, obj):
-        return SimpleUserSerializer(obj.user).data
-
     def create(self, validated_data):
         product_id = self.context['product_id']
         return Review.objects.create(product_id=product_id, **validated_data)
 
 
-class WishlistSerializer(serializers.ModelSerializer):
+class WishlistSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), write_only=True)
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from product.models import Product, Category, ProductImage, Wishlist
+from product.response_cache import invalidate
+from product.search import catalog_index, uses_database_search
+from product.wishlist import invalidate_wishlist
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    if not uses_database_search():
+        catalog_index.update(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    if not uses_database_search():
+        catalog_index.remove(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_catalog_cache(sender, **kwargs):
+    invalidate(sender._meta.model_name)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product(sender, instance, **kwargs):
+    # Images are part of the product representation, keep its Last-Modified/ETag honest
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Wishlist)
+def invalidate_wishlist_ids(sender, instance, **kwargs):
+    invalidate_wishlist(instance.user_id)
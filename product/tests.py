@@ -1,3 +1,1333 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import close_old_connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from api.query_budget import query_budget, QueryBudgetExceeded
+from product.models import (Category, ImageAsset, Product, ProductImage, ProductImageUpload, Review, StagedFile,
+                            Wishlist)
+from product.search import catalog_index, tokenize
+from product.response_cache import cache_stats
+from product.pricing import annotate_price_with_tax, tax_rates
+from product.ratings import apply_rating_change, rebuild_ratings
+from product.serializers import CategorySerializer, ProductSerializer, ReviewSerializer
+from product.fast_serializers import FastReadSerializer
+from product.images import IMAGE_VARIANTS, LocalImageBackend
+from product.image_queue import process_pending, stage_upload
+from product.views import ReviewViewSet
+
+
+class CatalogTestCase(TestCase):
+    """TestCase never commits, so generation bumps don't run: start every test with an empty response cache"""
+
+    def setUp(self):
+        super().setUp()
+        caches['catalog'].clear()
+
+
+class ProductFixtureMixin:
+    @classmethod
+    def create_products(cls, count, category=None, images=2):
+        category = category or Category.objects.create(name='Shirts')
+        products = [Product.objects.create(
+            name=f'Product {i}', description='Cotton', price=10 + i, stock=5, category=category)
+            for i in range(count)]
+        for product in products:
+            for _ in range(images):
+                ProductImage.objects.create(product=product, image='sample')
+        return products
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class ProductQueryCountTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_products(25)
+
+    def setUp(self):
+        super().setUp()
+        # Tax rates live in the catalog cache between requests
+        tax_rates()
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        # validators + count + products + images prefetch
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('products-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(response.data['results'][0]['images']), 2)
+
+    def test_retrieve_query_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse('products-detail', args=[self.products[0].pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_latest_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('products-latest'))
+        self.assertEqual(len(response.data), 8)
+
+
+class QueryBudgetTest(CatalogTestCase):
+    def test_raises_under_the_test_runner(self):
+        # The runner forces DEBUG off, budgets must still fail tests
+        self.assertTrue(settings.QUERY_BUDGET_RAISE)
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_raises_when_over_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1, label='two lookups'):
+                list(Category.objects.all())
+                list(Product.objects.all())
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_logs_when_over_budget(self):
+        with self.assertLogs('api.query_budget', level='WARNING'):
+            with query_budget(0, label='one lookup') as counter:
+                list(Category.objects.all())
+        self.assertEqual(counter.count, 1)
+
+
+class KeysetPaginationTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Pants')
+        cls.products = cls.create_products(23, category=category, images=0)
+        # Duplicate prices force the id tie-breaker to do its job
+        Product.objects.filter(pk__in=[p.pk for p in cls.products[:12]]).update(price=50)
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_default_ordering_walks_every_product_once(self):
+        seen = self.walk(reverse('products-list') + '?pagination=cursor')
+        self.assertEqual(seen, sorted((p.pk for p in self.products), reverse=True))
+
+    def test_ordering_filter_with_duplicate_keys(self):
+        seen = self.walk(reverse('products-list') + '?pagination=cursor&ordering=price')
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_previous_link_returns_to_prior_page(self):
+        first = self.client.get(reverse('products-list') + '?pagination=cursor&ordering=-price')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual([p['id'] for p in back.data['results']],
+                         [p['id'] for p in first.data['results']])
+
+    def test_deep_page_skips_count_query(self):
+        first = self.client.get(reverse('products-list') + '?pagination=cursor')
+        # validators + products + images prefetch, no COUNT
+        with self.assertNumQueries(3):
+            self.client.get(first.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('products-list') + '?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_stays_default(self):
+        response = self.client.get(reverse('products-list'))
+        self.assertEqual(response.data['count'], 23)
+
+
+class ProductSearchTest(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.shoes = Category.objects.create(name='Shoes')
+        cls.linen = Product.objects.create(
+            name='Linen shirt', description='Breathable summer shirt', price=40, stock=3, category=cls.shirts)
+        cls.oxford = Product.objects.create(
+            name='Oxford shirt', description='Classic cotton for the office', price=60, stock=3, category=cls.shirts)
+        cls.boot = Product.objects.create(
+            name='Leather boot', description='Shoes that go with any shirt', price=90, stock=3, category=cls.shoes)
+
+    def setUp(self):
+        super().setUp()
+        catalog_index.reset()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('products-list'), {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_tokenize_folds_plurals_and_stopwords(self):
+        self.assertEqual(tokenize('The Shirts for Dress'), ['shirt', 'dress'])
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('shirt'), [self.linen.pk, self.oxford.pk, self.boot.pk])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search('cotton shirt'), [self.oxford.pk])
+        self.assertEqual(self.search('silk shirt'), [])
+
+    def test_combines_with_product_filter(self):
+        self.assertEqual(self.search('shirt', category_id=self.shoes.pk), [self.boot.pk])
+        self.assertEqual(self.search('shirt', price__lt=50), [self.linen.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.search('shirt')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boot.description = 'Waterproof'
+            self.boot.save()
+            Product.objects.create(
+                name='Flannel shirt', description='Warm', price=30, stock=1, category=self.shirts)
+            self.oxford.delete()
+        self.assertEqual(len(self.search('shirt')), 2)
+        self.assertEqual(self.search('waterproof'), [self.boot.pk])
+
+    def test_index_follows_bulk_writes(self):
+        self.search('shirt')
+        with self.captureOnCommitCallbacks(execute=True):
+            flannel, = Product.objects.bulk_create([Product(
+                name='Flannel shirt', description='Warm', price=30, stock=1, category=self.shirts)])
+        self.assertEqual(self.search('flannel'), [flannel.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.linen.name = 'Linen tunic'
+            Product.objects.bulk_update([self.linen], ['name'])
+            Product.objects.filter(pk=self.boot.pk).update(description='Waterproof')
+            Product.objects.filter(pk=self.oxford.pk).delete()
+        self.assertEqual(self.search('shirt'), [flannel.pk, self.linen.pk])
+        self.assertEqual(self.search('tunic'), [self.linen.pk])
+
+
+class RatingAggregateTest(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Hats')
+        cls.product = Product.objects.create(
+            name='Cap', description='Cotton cap', price=15, stock=10, category=category)
+        cls.user = get_user_model().objects.create_user(email='buyer@example.com', password='pass')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('product-review-list', args=[self.product.pk])
+
+    def assertAggregates(self, count, total, average, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, count)
+        self.assertEqual(self.product.rating_sum, total)
+        self.assertEqual(self.product.avg_rating, Decimal(average))
+        self.assertEqual(list(self.product.rating_histogram.values()), histogram)
+
+    def test_create_update_delete_keep_aggregates_in_sync(self):
+        first = self.client.post(self.url, {'ratings': 5, 'comment': 'Great'})
+        self.client.post(self.url, {'ratings': 4, 'comment': 'Good'})
+        self.client.post(self.url, {'ratings': 4, 'comment': 'Fine'})
+        self.assertAggregates(3, 13, '4.33', [0, 0, 0, 2, 1])
+
+        detail = reverse('product-review-detail', args=[self.product.pk, first.data['id']])
+        self.client.patch(detail, {'ratings': 1})
+        self.assertAggregates(3, 9, '3.00', [1, 0, 0, 2, 0])
+
+        self.client.delete(detail)
+        self.assertAggregates(2, 8, '4.00', [0, 0, 0, 2, 0])
+
+    def test_changes_apply_to_the_current_rating(self):
+        first = self.client.post(self.url, {'ratings': 5, 'comment': 'Great'})
+        detail = reverse('product-review-detail', args=[self.product.pk, first.data['id']])
+        stale = Review.objects.get(pk=first.data['id'])
+        # Another request got there first; this one still holds the review as it was loaded
+        self.client.patch(detail, {'ratings': 2})
+        with mock.patch.object(ReviewViewSet, 'get_object', return_value=stale):
+            self.client.patch(detail, {'ratings': 3})
+            self.assertAggregates(1, 3, '3.00', [0, 0, 1, 0, 0])
+            self.client.delete(detail)
+            self.assertAggregates(0, 0, '0', [0, 0, 0, 0, 0])
+            self.assertEqual(self.client.delete(detail).status_code, 404)
+        self.assertAggregates(0, 0, '0', [0, 0, 0, 0, 0])
+
+    def test_product_save_does_not_overwrite_aggregates(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.client.post(self.url, {'ratings': 3, 'comment': 'Okay'})
+        stale.price = 20
+        stale.save()
+        self.assertAggregates(1, 3, '3.00', [0, 0, 1, 0, 0])
+
+    def test_rebuild_command(self):
+        for rating in (2, 5, 5):
+            Review.objects.create(product=self.product, user=self.user, ratings=rating, comment='-')
+        self.assertAggregates(0, 0, '0', [0, 0, 0, 0, 0])
+        call_command('rebuild_product_ratings', stdout=open('/dev/null', 'w'))
+        self.assertAggregates(3, 12, '4.00', [0, 1, 0, 0, 2])
+
+    def test_rebuild_rounds_like_live_updates(self):
+        # 33 / 8 = 4.125, exactly half way
+        for rating in (5, 5, 5, 5, 5, 4, 2, 2):
+            self.client.post(self.url, {'ratings': rating, 'comment': '-'})
+        self.assertAggregates(8, 33, '4.13', [0, 2, 0, 1, 5])
+        rebuild_ratings()
+        self.assertAggregates(8, 33, '4.13', [0, 2, 0, 1, 5])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class RatingRebuildConcurrencyTest(TransactionTestCase):
+    """A rating change in flight while the rebuild runs is neither lost nor counted twice"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Hats')
+        self.product = Product.objects.create(
+            name='Cap', description='Cotton cap', price=15, stock=10, category=category)
+        self.user = get_user_model().objects.create_user(email='buyer@example.com', password='pass')
+
+    def test_change_committed_during_the_rebuild(self):
+        changing, rebuilt = threading.Event(), []
+
+        def rebuild():
+            changing.wait()
+            try:
+                rebuilt.append(rebuild_ratings())
+            finally:
+                close_old_connections()
+
+        thread = threading.Thread(target=rebuild)
+        thread.start()
+        with transaction.atomic():
+            Review.objects.create(product=self.product, user=self.user, ratings=4, comment='-')
+            apply_rating_change(self.product.pk, added=4)
+            changing.set()
+            # The rebuild waits on the product row until this commits
+            time.sleep(0.5)
+        thread.join()
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(rebuilt, [1])
+        self.assertEqual((product.review_count, product.rating_sum, product.avg_rating), (1, 4, Decimal('4.00')))
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class ReviewListTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = cls.create_products(1, images=0)[0]
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser(email='admin@example.com', password='pass')
+        cls.users = User.objects.bulk_create(
+            [User(email=f'user{i}@example.com', first_name=f'User{i}', password='!') for i in range(30)])
+        cls.reviews = Review.objects.bulk_create([
+            Review(product=cls.product, user=user, ratings=i % 5 + 1, comment='-')
+            for i, user in enumerate(cls.users)])
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('product-review-list', args=[self.product.pk])
+
+    def test_paginated_with_users(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(len(response.data['results']), 20)
+        review = response.data['results'][0]
+        self.assertEqual(review['user'], {'id': self.users[-1].pk, 'name': 'User29'})
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'page_size': 30})
+        self.assertEqual(len(response.data['results']), 30)
+
+    def test_page_size_is_bounded(self):
+        Review.objects.bulk_create([
+            Review(product=self.product, user=self.admin, ratings=5, comment='-') for _ in range(100)])
+        response = self.client.get(self.url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 100)
+
+    def test_ordering_by_rating_is_stable(self):
+        response = self.client.get(self.url, {'ordering': '-ratings', 'page_size': 30})
+        results = [(review['ratings'], review['id']) for review in response.data['results']]
+        self.assertEqual(results, sorted(results, reverse=True))
+
+    def test_my_reviews_paginated(self):
+        self.client.force_authenticate(self.users[0])
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('reviews-my-reviews'))
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['id'], self.reviews[0].pk)
+
+    def test_my_reviews_requires_login(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('reviews-my-reviews')).status_code, 401)
+
+
+class WishlistMembershipTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_products(5, images=1)
+        User = get_user_model()
+        cls.user = User.objects.create_user(email='shopper@example.com', password='pass')
+        cls.other = User.objects.create_user(email='other@example.com', password='pass')
+        Wishlist.objects.create(user=cls.user, product=cls.products[1])
+        Wishlist.objects.create(user=cls.other, product=cls.products[2])
+
+    def setUp(self):
+        super().setUp()
+        tax_rates()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(reverse('wishlist-batch'), {'product_ids': ids}, format='json')
+
+    def test_ids_are_cached_until_the_wishlist_changes(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('wishlist-ids')).data, {'product_ids': [self.products[1].pk]})
+        with self.assertNumQueries(0):
+            self.client.get(reverse('wishlist-ids'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Wishlist.objects.create(user=self.user, product=self.products[3])
+        self.assertEqual(self.client.get(reverse('wishlist-ids')).data['product_ids'],
+                         sorted([self.products[1].pk, self.products[3].pk]))
+
+    def test_products_annotated_with_in_wishlist(self):
+        response = self.client.get(reverse('products-list'), {'with_wishlist': 'true'})
+        flags = {product['id']: product['in_wishlist'] for product in response.json()['results']}
+        self.assertEqual(flags, {product.pk: product == self.products[1] for product in self.products})
+
+        detail = self.client.get(reverse('products-detail', args=[self.products[2].pk]), {'with_wishlist': '1'})
+        self.assertIs(detail.json()['in_wishlist'], False)
+
+    def test_in_wishlist_costs_no_extra_query(self):
+        self.client.get(reverse('wishlist-ids'))
+        with self.assertNumQueries(4):  # validators, count, page, images
+            self.client.get(reverse('products-list'), {'with_wishlist': 'true'})
+
+    def test_in_wishlist_only_when_asked_for(self):
+        response = self.client.get(reverse('products-list'))
+        self.assertNotIn('in_wishlist', response.json()['results'][0])
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('products-list'), {'with_wishlist': 'true'})
+        self.assertNotIn('in_wishlist', response.json()['results'][0])
+
+    def test_etag_changes_with_the_wishlist(self):
+        url = reverse('products-detail', args=[self.products[3].pk])
+        etag = self.client.get(url, {'with_wishlist': 'true'})['ETag']
+        self.assertEqual(self.client.get(url, {'with_wishlist': 'true'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.batch('post', [self.products[3].pk])
+        response = self.client.get(url, {'with_wishlist': 'true'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()['in_wishlist']), (200, True))
+
+    def test_batch_add_skips_existing_and_unknown(self):
+        ids = [self.products[0].pk, self.products[1].pk, self.products[2].pk, 9999]
+        response = self.batch('post', ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'product_ids': ids[:3], 'missing_ids': [9999]})
+        self.assertEqual(Wishlist.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(self.client.get(reverse('wishlist-ids')).data['product_ids'], ids[:3])
+
+    def test_batch_remove(self):
+        self.batch('post', [self.products[0].pk])
+        response = self.batch('delete', [self.products[0].pk, self.products[2].pk])
+        self.assertEqual(response.data['product_ids'], [self.products[1].pk])
+        self.assertTrue(Wishlist.objects.filter(user=self.other, product=self.products[2]).exists())
+
+    def test_batch_validation(self):
+        self.assertEqual(self.batch('post', 'nope').status_code, 400)
+        self.assertEqual(self.batch('post', list(range(1, 102))).status_code, 400)
+
+
+class CategoryProductCountTest(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.shoes = Category.objects.create(name='Shoes')
+
+    def new_product(self, category, **fields):
+        return Product(name='Item', description='-', price=10, stock=1, category=category, **fields)
+
+    def assertCounts(self, shirts, shoes):
+        self.assertEqual(Category.objects.get(pk=self.shirts.pk).product_count, shirts)
+        self.assertEqual(Category.objects.get(pk=self.shoes.pk).product_count, shoes)
+
+    def test_save_reassign_and_delete(self):
+        product = self.new_product(self.shirts)
+        product.save()
+        self.new_product(self.shirts).save()
+        self.assertCounts(2, 0)
+
+        product = Product.objects.get(pk=product.pk)
+        product.category = self.shoes
+        product.save()
+        self.assertCounts(1, 1)
+
+        product.delete()
+        self.assertCounts(1, 0)
+
+    def test_bulk_operations(self):
+        Product.objects.bulk_create([self.new_product(self.shirts) for _ in range(4)]
+                                    + [self.new_product(self.shoes)])
+        self.assertCounts(4, 1)
+
+        moved = Product.objects.filter(category=self.shirts).order_by('pk').values_list('pk', flat=True)[:2]
+        Product.objects.filter(pk__in=list(moved)).update(category=self.shoes)
+        self.assertCounts(2, 3)
+
+        products = list(Product.objects.filter(category=self.shoes))
+        for product in products:
+            product.category = self.shirts
+        Product.objects.bulk_update(products, ['category'])
+        self.assertCounts(5, 0)
+
+        Product.objects.filter(category=self.shirts).delete()
+        self.assertCounts(0, 0)
+
+    def test_deleting_a_deleted_product_keeps_count(self):
+        self.new_product(self.shirts).save()
+        first, second = Product.objects.get(), Product.objects.get()
+        first.delete()
+        second.delete()
+        self.assertCounts(0, 0)
+
+    def test_upsert_recounts_the_categories_left(self):
+        kept, moved = self.new_product(self.shirts), self.new_product(self.shirts)
+        kept.save()
+        moved.save()
+        Product.objects.bulk_create(
+            [self.new_product(self.shoes, id=moved.pk), self.new_product(self.shoes)],
+            update_conflicts=True, unique_fields=['id'], update_fields=['category'])
+        self.assertCounts(1, 2)
+
+    def test_category_save_keeps_count(self):
+        stale = Category.objects.get(pk=self.shirts.pk)
+        self.new_product(self.shirts).save()
+        stale.name = 'Tops'
+        stale.save()
+        self.assertCounts(1, 0)
+
+    def test_reconcile_command(self):
+        Product.objects.bulk_create([self.new_product(self.shirts) for _ in range(3)])
+        Category.objects.filter(pk=self.shirts.pk).update(product_count=9)
+        call_command('reconcile_category_counts', stdout=open('/dev/null', 'w'))
+        self.assertCounts(3, 0)
+
+    def test_category_list_reads_column(self):
+        self.new_product(self.shirts).save()
+        # validators + categories
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('category-list'))
+        self.assertEqual(response.data[0]['product_count'], 1)
+
+
+class PriceWithTaxTest(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.books = Category.objects.create(name='Books', tax_rate=Decimal('0.05'))
+        cls.shirt = Product.objects.create(name='Shirt', description='-', price=Decimal('19.99'),
+                                           stock=1, category=cls.shirts)
+        cls.book = Product.objects.create(name='Book', description='-', price=Decimal('20.50'),
+                                          stock=1, category=cls.books)
+
+    def prices(self, **params):
+        response = self.client.get(reverse('products-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [(item['id'], item['price_with_tax']) for item in response.json()['results']]
+
+    def test_rate_per_category_rounded_to_cents(self):
+        self.assertEqual(dict(self.prices()), {self.shirt.pk: 21.99, self.book.pk: 21.53})
+
+    def test_sortable_and_filterable(self):
+        self.assertEqual(self.prices(ordering='price_with_tax'),
+                         [(self.book.pk, 21.53), (self.shirt.pk, 21.99)])
+        self.assertEqual(self.prices(price_with_tax__lt='21.9'), [(self.book.pk, 21.53)])
+        self.assertEqual(self.prices(price_with_tax__gt='21.9'), [(self.shirt.pk, 21.99)])
+
+    def test_rate_change_reaches_cached_responses(self):
+        self.prices()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books.tax_rate = Decimal('0.25')
+            self.books.save()
+        self.assertEqual(dict(self.prices())[self.book.pk], 25.63)
+
+    def test_unannotated_instances_match_the_annotation(self):
+        annotated = ProductSerializer(annotate_price_with_tax(Product.objects.order_by('pk')), many=True).data
+        loaded = ProductSerializer(Product.objects.order_by('pk'), many=True).data
+        self.assertEqual([item['price_with_tax'] for item in annotated],
+                         [item['price_with_tax'] for item in loaded])
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class ProductFacetsTest(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.shoes = Category.objects.create(name='Shoes')
+        for name, price, category in [('Linen shirt', 20, cls.shirts), ('Oxford shirt', 45, cls.shirts),
+                                      ('Silk shirt', 250, cls.shirts), ('Leather boot', 90, cls.shoes),
+                                      ('Canvas shoe', 30, cls.shoes)]:
+            Product.objects.create(name=name, description='-', price=price, stock=1, category=category)
+
+    def setUp(self):
+        super().setUp()
+        catalog_index.reset()
+
+    def facets(self, **params):
+        response = self.client.get(reverse('products-facets'), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return (data['total'], {item['name']: item['count'] for item in data['categories']},
+                [item['count'] for item in data['price_ranges']])
+
+    def test_counts_whole_catalog_in_one_aggregate(self):
+        # Category lookup and the aggregate
+        with self.assertNumQueries(2):
+            total, categories, prices = self.facets()
+        self.assertEqual(total, 5)
+        self.assertEqual(categories, {'Shirts': 3, 'Shoes': 2})
+        self.assertEqual(prices, [1, 2, 1, 0, 1, 0])
+
+    def test_each_facet_ignores_its_own_filter(self):
+        total, categories, prices = self.facets(category_id=self.shoes.pk, price__lt=100)
+        self.assertEqual(total, 2)
+        self.assertEqual(categories, {'Shirts': 2, 'Shoes': 2})
+        self.assertEqual(prices, [0, 1, 1, 0, 0, 0])
+
+    def test_price_with_tax_filter_matches_the_list(self):
+        params = {'price_with_tax__gt': 30, 'price_with_tax__lt': 120}
+        listed = self.client.get(reverse('products-list'), params).json()['count']
+        total, categories, prices = self.facets(**params)
+        # 33, 49.50 and 99 with tax; only 45 and 90 before it
+        self.assertEqual((total, listed), (3, 3))
+        self.assertEqual(categories, {'Shirts': 1, 'Shoes': 2})
+
+    def test_follows_search_query(self):
+        total, categories, prices = self.facets(search='shirt')
+        self.assertEqual((total, categories), (3, {'Shirts': 3, 'Shoes': 0}))
+        self.assertEqual(self.facets(search='velvet')[0], 0)
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get(reverse('products-facets'), {'price__lt': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_per_filter_and_refreshed_by_category_rename(self):
+        url = reverse('products-facets')
+        self.assertEqual(self.client.get(url, {'category_id': self.shirts.pk})['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, {'category_id': self.shirts.pk})['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url, {'category_id': self.shoes.pk})['X-Cache'], 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes.name = 'Footwear'
+            self.shoes.save()
+        response = self.client.get(url, {'category_id': self.shirts.pk})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Footwear', [item['name'] for item in response.json()['categories']])
+
+
+class ResponseCacheTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_products(3, images=1)
+
+    def test_anonymous_list_is_served_from_cache(self):
+        url = reverse('products-list')
+        first = self.client.get(url, {'ordering': 'price', 'page': 1})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {'page': 1, 'ordering': 'price'})
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(cache_stats()['hits'], 1)
+
+    def test_save_invalidates_dependent_responses(self):
+        url = reverse('products-detail', args=[self.products[0].pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[0].pk).update(price=99)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['price'], 99)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.products[0], image='extra')
+        self.assertEqual(len(self.client.get(url).json()['images']), 2)
+
+    def test_category_counts_refresh_after_product_create(self):
+        url = reverse('category-list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='New', description='-', price=1, stock=1,
+                                   category=self.products[0].category)
+        self.assertEqual(self.client.get(url).json()[0]['product_count'], 4)
+
+    def test_authenticated_requests_bypass_cache(self):
+        response = self.client.get(reverse('products-list'), HTTP_AUTHORIZATION='JWT invalid')
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class ResponseCacheAutocommitTest(TransactionTestCase):
+    """Outside a transaction on_commit runs at once, generations must still move after the write"""
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.category = Category.objects.create(name='Shirts')
+        self.product = Product.objects.create(
+            name='Shirt', description='-', price=10, stock=5, category=self.category)
+
+    def bumped_after(self, write, read):
+        seen = []
+        with mock.patch('product.response_cache.bump_generation', side_effect=lambda *names: seen.append(read())):
+            write()
+        return seen
+
+    def test_bulk_writes_bump_after_writing(self):
+        price = lambda: Product.objects.get(pk=self.product.pk).price
+        self.assertEqual(self.bumped_after(
+            lambda: Product.objects.filter(pk=self.product.pk).update(price=99), price), [99])
+        self.assertEqual(set(self.bumped_after(
+            lambda: Product.objects.filter(pk=self.product.pk).delete(), Product.objects.exists)), {False})
+
+    def test_reconcile_bumps_after_writing(self):
+        Category.objects.update(product_count=7)
+        count = lambda: Category.objects.get(pk=self.category.pk).product_count
+        self.assertEqual(self.bumped_after(lambda: Category.objects.reconcile_product_counts(), count), [1])
+
+
+class ConditionalGetTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_products(3, images=1)
+
+    def setUp(self):
+        super().setUp()
+        # Exercise the views themselves, not the response cache
+        caches['catalog'].set = lambda *args, **kwargs: None
+
+    def tearDown(self):
+        del caches['catalog'].set
+
+    def test_retrieve_answers_304_without_serializing(self):
+        url = reverse('products-detail', args=[self.products[0].pk])
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        # tax rates (the cache is off here) + updated_at
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_etag_follows_filters_and_changes(self):
+        url = reverse('products-list')
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(etag, self.client.get(url, {'price__lt': 11})['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ProductImage.objects.create(product=self.products[1], image='new')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rating_change_moves_last_modified(self):
+        before = Product.objects.get(pk=self.products[0].pk).updated_at
+        user = get_user_model().objects.create_user(email='r@example.com', password='pass')
+        client = APIClient()
+        client.force_authenticate(user)
+        client.post(reverse('product-review-list', args=[self.products[0].pk]),
+                    {'ratings': 4, 'comment': 'Nice'})
+        self.assertGreater(Product.objects.get(pk=self.products[0].pk).updated_at, before)
+
+    def test_list_revalidates_deletes_by_etag_only(self):
+        url = reverse('category-list')
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        Category.objects.create(name='Empty').delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Product.objects.filter(pk=self.products[0].pk).delete()
+        Category.objects.filter(pk=self.products[0].category_id).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class CachedConditionalGetTest(ProductFixtureMixin, CatalogTestCase):
+    def test_cache_hit_still_revalidates(self):
+        product = self.create_products(1)[0]
+        url = reverse('products-detail', args=[product.pk])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class ImportCatalogTest(CatalogTestCase):
+    def write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def run_import(self, path, *args):
+        out = io.StringIO()
+        call_command('import_catalog', path, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_json_array_streams_across_chunks(self):
+        from product.management.commands.import_catalog import iter_json_array
+        rows = [{'name': f'P{i}', 'tags': ['a', ']'], 'n': i} for i in range(5)]
+        stream = io.StringIO(json.dumps(rows, indent=2))
+        self.assertEqual(list(iter_json_array(stream, chunk_size=7)), rows)
+
+    def test_fixture_and_flat_rows(self):
+        category = Category.objects.create(name='Shirts')
+        path = self.write('.json', json.dumps([
+            {'model': 'product.product', 'pk': 1, 'fields': {
+                'name': 'Fixture shirt', 'description': '-', 'price': '12.50', 'stock': 3,
+                'category': category.pk}},
+            {'name': 'Flat shirt', 'description': '-', 'price': 10, 'stock': 1, 'category': 'Shirts'},
+            {'name': 'Bad price', 'description': '-', 'price': -1, 'stock': 1, 'category': 'Shirts'},
+        ]))
+        output = self.run_import(path, '--batch-size', '2')
+        self.assertIn('2 created, 0 updated, 1 skipped', output)
+        self.assertIn('rows/sec', output)
+        self.assertEqual(Category.objects.get(pk=category.pk).product_count, 2)
+
+    def test_csv_creates_categories_once(self):
+        path = self.write('.csv', 'name,description,price,stock,category\n'
+                                  'Boot,Leather,90,2,Shoes\n'
+                                  'Sandal,Summer,30,5,Shoes\n'
+                                  'Cap,Cotton,15,9,Hats\n')
+        self.run_import(path)
+        self.assertEqual(dict(Category.objects.values_list('name', 'product_count')),
+                         {'Shoes': 2, 'Hats': 1})
+
+    def test_upsert_by_natural_key(self):
+        shoes = Category.objects.create(name='Shoes')
+        boot = Product.objects.create(name='Boot', description='Old', price=80, stock=1, category=shoes)
+        rows = [{'name': 'Boot', 'description': 'New', 'price': 95, 'stock': 4, 'category': 'Shoes'},
+                {'name': 'Clog', 'description': 'Wood', 'price': 40, 'stock': 2, 'category': 'Shoes'}]
+        path = self.write('.jsonl', '\n'.join(json.dumps(row) for row in rows))
+        output = self.run_import(path, '--upsert-key', 'name,category')
+        self.assertIn('1 created, 1 updated', output)
+        boot.refresh_from_db()
+        self.assertEqual((boot.description, boot.price, boot.stock), ('New', 95, 4))
+        self.assertEqual(Category.objects.get(pk=shoes.pk).product_count, 2)
+
+    def test_rows_the_database_would_reject_are_skipped(self):
+        rows = [{'name': 'x' * 201, 'price': 10, 'stock': 1, 'category': 'Hats'},
+                {'name': 'Huge', 'price': '123456789.00', 'stock': 1, 'category': 'Hats'},
+                {'name': 'Fine', 'price': '1.005', 'stock': 1, 'category': 'Hats'},
+                {'name': 'Cap', 'price': 15, 'stock': 1, 'category': 'Hats'}]
+        path = self.write('.jsonl', '\n'.join(json.dumps(row) for row in rows))
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err)
+        self.assertIn('1 created, 0 updated, 3 skipped', out.getvalue())
+        self.assertEqual([line.split(':')[0] for line in err.getvalue().splitlines()],
+                         ['Row 1 skipped', 'Row 2 skipped', 'Row 3 skipped'])
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Cap'])
+
+    def test_duplicate_upsert_keys_are_reported(self):
+        rows = [{'name': 'Boot', 'description': 'First', 'price': 90, 'stock': 1, 'category': 'Shoes'},
+                {'name': 'Boot', 'description': 'Second', 'price': 95, 'stock': 2, 'category': 'Shoes'}]
+        path = self.write('.jsonl', '\n'.join(json.dumps(row) for row in rows))
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', path, '--upsert-key', 'name', stdout=out, stderr=err)
+        self.assertIn('1 created, 0 updated, 1 skipped', out.getvalue())
+        self.assertIn('Row 1 skipped: row 2 has the same upsert key', err.getvalue())
+        self.assertEqual(Product.objects.get().description, 'Second')
+
+
+class ProductBulkTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Socks')
+        cls.admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('products-bulk')
+        tax_rates()
+
+    def payload(self, count, **fields):
+        return [{'name': f'Sock {i}', 'description': '-', 'price': '5.00', 'stock': 10,
+                 'category': self.category.pk, **fields} for i in range(count)]
+
+    def test_bulk_create_in_constant_queries(self):
+        # categories, insert, category count, images prefetch (+ savepoints)
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url, self.payload(50), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 50)
+        self.assertEqual(Category.objects.get(pk=self.category.pk).product_count, 50)
+
+    def test_per_item_errors_and_nothing_saved(self):
+        payload = self.payload(3)
+        payload[1]['price'] = '-1'
+        payload[2]['category'] = 999
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(str(response.data[1]['price'][0]), 'Price could not be negative')
+        self.assertIn('category', response.data[2])
+        self.assertFalse(Product.objects.exists())
+
+    def test_bulk_partial_update(self):
+        products = self.create_products(3, category=self.category, images=0)
+        payload = [{'id': product.pk, 'price': '7.50'} for product in products]
+        payload.append({'id': 0, 'price': '1.00'})
+        response = self.client.patch(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('id', response.data[3])
+
+        response = self.client.patch(self.url, payload[:3], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(Product.objects.values_list('price', flat=True)), {Decimal('7.50')})
+
+    def test_bulk_delete(self):
+        products = self.create_products(3, category=self.category, images=1)
+        response = self.client.delete(self.url, {'ids': [products[0].pk, products[1].pk, 0]}, format='json')
+        self.assertEqual(response.data, {'deleted': 2, 'missing_ids': [0]})
+        self.assertEqual(Category.objects.get(pk=self.category.pk).product_count, 1)
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(self.url, self.payload(1), format='json').status_code, 401)
+
+
+class SparseFieldsetTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_products(3)
+        cls.user = get_user_model().objects.create_user(email='fan@example.com', password='pass')
+        for product in cls.products:
+            Wishlist.objects.create(user=cls.user, product=product)
+
+    def setUp(self):
+        super().setUp()
+        tax_rates()
+
+    def test_fields_trim_payload_and_columns(self):
+        # validators + count + products, no images prefetch
+        with self.assertNumQueries(3) as queries:
+            response = self.client.get(reverse('products-list'), {'fields': 'id,name,price_with_tax'})
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'name', 'price_with_tax'])
+        self.assertEqual(response.json()['results'][0]['price_with_tax'], 13.2)
+        product_query = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"description"', product_query)
+        self.assertNotIn('"search_vector"', product_query)
+
+    def test_omit_drops_fields_and_prefetch(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('products-list'), {'omit': 'description,images'})
+        item = response.json()['results'][0]
+        self.assertNotIn('description', item)
+        self.assertNotIn('images', item)
+        self.assertEqual(item['rating_histogram'], {str(rating): 0 for rating in range(1, 6)})
+
+    def test_nested_fieldset_on_wishlist(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # wishlist joined with products + images prefetch
+        with self.assertNumQueries(2) as queries:
+            response = client.get(reverse('wishlist-list'), {'fields': 'id,product.name,product.images'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('"description"', queries.captured_queries[0]['sql'])
+        item = response.json()[0]
+        self.assertEqual(list(item), ['id', 'product'])
+        self.assertEqual(list(item['product']), ['name', 'images'])
+        self.assertEqual(len(item['product']['images']), 2)
+
+    def test_writes_ignore_fieldset(self):
+        admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post(reverse('products-list') + '?fields=id', {
+            'name': 'Scarf', 'description': 'Wool', 'price': '12.00', 'stock': 4,
+            'category': self.products[0].category_id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['description'], 'Wool')
+
+
+class FastReadSerializerTest(ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_products(4)
+        Category.objects.create(name='Empty', description=None, tax_rate=Decimal('0.0725'))
+        user = get_user_model().objects.create_user(
+            email='critic@example.com', password='pass', first_name='Ada', last_name='Lovelace')
+        for product in cls.products[:2]:
+            Review.objects.create(product=product, user=user, ratings=4, comment='Good')
+
+    def assertSameJSON(self, serializer_class, rows, context=None):
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_class(rows, many=True, context=context or {}).data)
+        actual = renderer.render(FastReadSerializer(serializer_class, rows, many=True, context=context).data)
+        self.assertEqual(actual, expected)
+
+    def test_byte_identical_output(self):
+        self.assertSameJSON(ProductSerializer, list(annotate_price_with_tax(
+            Product.objects.prefetch_related('images'))))
+        self.assertSameJSON(ProductSerializer, list(Product.objects.all()))
+        self.assertSameJSON(CategorySerializer, list(Category.objects.all()))
+        self.assertSameJSON(ReviewSerializer, list(Review.objects.select_related('user')))
+
+    def test_byte_identical_with_sparse_fieldset(self):
+        request = Request(APIRequestFactory().get('/', {'fields': 'id,price,images', 'omit': 'images.image'}))
+        self.assertSameJSON(ProductSerializer, list(Product.objects.prefetch_related('images')),
+                            context={'request': request})
+
+    def test_list_endpoints_use_fast_path(self):
+        with mock.patch.object(ProductSerializer, 'to_representation') as to_representation:
+            response = self.client.get(reverse('products-list'))
+        self.assertEqual(len(response.json()['results']), 4)
+        to_representation.assert_not_called()
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_serializers', '--repeat', '1', stdout=out)
+        self.assertIn('ProductSerializer: 4 rows', out.getvalue())
+        self.assertIn('ReviewSerializer: 2 rows', out.getvalue())
+
+
+def make_image_file(name='photo.png', size=(1200, 800), color='red'):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageMediaTestMixin:
+    """
+    Run the image pipeline on LocalImageBackend in a throwaway MEDIA_ROOT, staged
+    under its staging/ directory, uploads processed in the request
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(
+            PRODUCT_IMAGE_BACKEND='product.images.LocalImageBackend',
+            MEDIA_ROOT=media_root,
+            PRODUCT_IMAGE_STAGING_STORAGE={'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                                           'OPTIONS': {'location': os.path.join(media_root, 'staging')}},
+            PRODUCT_IMAGE_QUEUE_EAGER=True)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.media_root = media_root
+
+    def upload(self, url, file, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, {'image': file}, format='multipart')
+        return response
+
+
+class ProductImageVariantTest(ImageMediaTestMixin, ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = cls.create_products(1, images=0)[0]
+        cls.admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('product-images-list', args=[self.product.pk])
+
+    def test_upload_records_variants(self):
+        self.upload(self.url, make_image_file())
+        variants = ProductImage.objects.get().variants
+        self.assertEqual(set(variants), set(IMAGE_VARIANTS))
+        self.assertEqual((variants['thumbnail']['width'], variants['thumbnail']['height']), (200, 133))
+        self.assertEqual((variants['zoom']['width'], variants['zoom']['height']), (1200, 800))
+        path = os.path.join(self.media_root, variants['card']['url'].removeprefix('/media/'))
+        with PILImage.open(path) as card:
+            self.assertEqual((card.format, card.width), ('WEBP', 600))
+
+    def test_variants_are_served_with_products(self):
+        self.upload(self.url, make_image_file())
+        response = self.client.get(reverse('products-detail', args=[self.product.pk]),
+                                   {'fields': 'id,images.variants'})
+        images = response.json()['images']
+        self.assertEqual(list(images[0]), ['variants'])
+        self.assertTrue(images[0]['variants']['thumbnail']['url'].endswith('/thumbnail.webp'))
+
+    def test_rejects_files_that_are_not_images(self):
+        upload = SimpleUploadedFile('notes.png', b'not an image', content_type='image/png')
+        response = self.upload(self.url, upload)
+        self.assertEqual(response.status_code, 202)
+        upload = ProductImageUpload.objects.get()
+        self.assertEqual((upload.status, upload.error), (ProductImageUpload.FAILED, 'Upload a valid image.'))
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_backfill_command(self):
+        self.upload(self.url, make_image_file())
+        ProductImage.objects.update(variants={})
+        out = io.StringIO()
+        call_command('build_image_variants', stdout=out, stderr=io.StringIO())
+        self.assertIn('Built variants for 1 images', out.getvalue())
+        self.assertEqual(ProductImage.objects.get().variants['card']['width'], 600)
+
+
+class ProductImageUploadQueueTest(ImageMediaTestMixin, ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = cls.create_products(1, images=0)[0]
+        cls.admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = reverse('product-images-list', args=[self.product.pk])
+
+    def test_upload_is_acknowledged_before_processing(self):
+        with override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False):
+            response = self.upload(self.url, make_image_file())
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['product_image']), ('pending', None))
+        upload = ProductImageUpload.objects.get()
+        self.assertEqual(upload.status, ProductImageUpload.PENDING)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'staging', upload.staged_file)))
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(process_pending(), (0, 1))
+        self.assertEqual(len(self.client.get(self.url).json()), 1)
+
+    @override_settings(PRODUCT_IMAGE_STAGING_STORAGE={'BACKEND': 'product.image_queue.DatabaseStagingStorage'},
+                       PRODUCT_IMAGE_QUEUE_EAGER=False)
+    def test_staging_in_the_database(self):
+        content = make_image_file().read()
+        self.upload(self.url, SimpleUploadedFile('photo.png', content))
+        upload = ProductImageUpload.objects.get()
+        self.assertEqual(bytes(StagedFile.objects.get(name=upload.staged_file).content), content)
+
+        process_pending()
+        self.assertEqual(ProductImage.objects.get().content_hash, hashlib.sha256(content).hexdigest())
+        self.assertFalse(StagedFile.objects.exists())
+
+    @override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False)
+    def test_upload_is_hashed_while_staged(self):
+        file = make_image_file()
+        content, reads = file.read(), []
+        read = file.file.read
+        file.file.read = lambda *args: reads.append(read(*args)) or reads[-1]
+        upload = stage_upload(self.product.pk, file)
+        self.assertEqual(b''.join(reads), content)
+        self.assertEqual(upload.content_hash, hashlib.sha256(content).hexdigest())
+
+    def test_status_shows_the_stored_image(self):
+        upload_id = self.upload(self.url, make_image_file()).data['id']
+        response = self.client.get(reverse('product-image-uploads-detail', args=[self.product.pk, upload_id]))
+        self.assertEqual(response.data['status'], 'done')
+        self.assertEqual(response.data['product_image']['id'], ProductImage.objects.get().pk)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'staging', 'image-uploads')), [])
+
+    def test_failed_attempts_are_retried(self):
+        store, calls = LocalImageBackend.store, []
+
+        def flaky(backend, file):
+            calls.append(file)
+            if len(calls) == 1:
+                raise OSError('connection reset')
+            return store(backend, file)
+
+        with mock.patch.object(LocalImageBackend, 'store', autospec=True, side_effect=flaky), \
+                self.assertLogs('product.image_queue', 'WARNING'):
+            self.upload(self.url, make_image_file())
+        upload = ProductImageUpload.objects.get()
+        self.assertEqual((upload.status, upload.attempts), (ProductImageUpload.DONE, 2))
+        self.assertIsNotNone(upload.image)
+
+    def test_retries_wait_for_their_turn(self):
+        with override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False):
+            self.upload(self.url, make_image_file())
+        with mock.patch.object(LocalImageBackend, 'store', side_effect=OSError('connection reset')), \
+                self.assertLogs('product.image_queue', 'WARNING'):
+            self.assertEqual(process_pending(), (0, 1))
+        upload = ProductImageUpload.objects.get()
+        self.assertEqual((upload.status, upload.attempts), (ProductImageUpload.PENDING, 1))
+        self.assertGreater(upload.next_attempt_at, upload.updated_at)
+        self.assertEqual(process_pending(), (0, 0))
+
+        ProductImageUpload.objects.update(next_attempt_at=upload.updated_at)
+        self.assertEqual(process_pending(), (0, 1))
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.attempts), (ProductImageUpload.DONE, 2))
+
+    def test_update_goes_through_the_queue(self):
+        self.upload(self.url, make_image_file(color='red'))
+        image = ProductImage.objects.get()
+        detail = reverse('product-images-detail', args=[self.product.pk, image.pk])
+        with override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False):
+            response = self.upload(detail, make_image_file(color='blue'), method='put')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['replaces_image']), ('pending', True))
+        self.assertEqual(ProductImage.objects.get().image.public_id, image.image.public_id)
+
+        process_pending()
+        replaced = ProductImage.objects.get()
+        self.assertNotEqual(replaced.image.public_id, image.image.public_id)
+        self.assertNotEqual(replaced.content_hash, image.content_hash)
+        self.assertEqual(ProductImageUpload.objects.get(pk=response.data['id']).image, replaced)
+
+    def test_replaced_file_is_served_fresh(self):
+        self.upload(self.url, make_image_file(color='red'))
+        image = ProductImage.objects.get()
+        anonymous, product_url = APIClient(), reverse('products-detail', args=[self.product.pk])
+        etag = anonymous.get(product_url)['ETag']
+        old_url = anonymous.get(self.url).json()[0]['image']
+        self.assertEqual(anonymous.get(product_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.upload(reverse('product-images-detail', args=[self.product.pk, image.pk]),
+                    make_image_file(color='blue'), method='put')
+        response = anonymous.get(product_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        new_url = anonymous.get(self.url).json()[0]['image']
+        self.assertNotEqual(new_url, old_url)
+        self.assertEqual(response.json()['images'][0]['image'], new_url)
+
+    def test_update_of_a_deleted_image_fails(self):
+        self.upload(self.url, make_image_file())
+        image = ProductImage.objects.get()
+        with override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False):
+            self.upload(reverse('product-images-detail', args=[self.product.pk, image.pk]),
+                        make_image_file(color='blue'), method='patch')
+        image.delete()
+        process_pending()
+        upload = ProductImageUpload.objects.get(replaces_image=True)
+        self.assertEqual((upload.status, upload.error), (ProductImageUpload.FAILED, 'The image was deleted.'))
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_gives_up_after_max_attempts(self):
+        with override_settings(PRODUCT_IMAGE_MAX_ATTEMPTS=3), \
+                mock.patch.object(LocalImageBackend, 'store', side_effect=OSError('connection reset')), \
+                self.assertLogs('product.image_queue', 'ERROR'):
+            self.upload(self.url, make_image_file())
+        upload = ProductImageUpload.objects.get()
+        self.assertEqual((upload.status, upload.attempts), (ProductImageUpload.FAILED, 3))
+        self.assertIn('connection reset', upload.error)
+        self.assertEqual(upload.staged_file, '')
+
+    def test_unknown_product(self):
+        response = self.upload(reverse('product-images-list', args=[self.product.pk + 100]), make_image_file())
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(ProductImageUpload.objects.exists())
+
+    def test_command_processes_stale_uploads(self):
+        with override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False):
+            self.upload(self.url, make_image_file())
+        ProductImageUpload.objects.update(status=ProductImageUpload.PROCESSING)
+        out = io.StringIO()
+        call_command('process_image_uploads', '--stale-after', '0', stdout=out)
+        self.assertIn('Requeued 1 stale uploads, processed 1; 0 pending, 0 processing, 1 done, 0 failed',
+                      out.getvalue())
+        self.assertTrue(ProductImage.objects.exists())
+
+    @override_settings(CRON_SECRET='s3cret', PRODUCT_IMAGE_CRON_BATCH=1)
+    def test_cron_endpoint_processes_a_batch(self):
+        with override_settings(PRODUCT_IMAGE_QUEUE_EAGER=False):
+            self.upload(self.url, make_image_file(color='red'))
+            self.upload(self.url, make_image_file(color='blue'))
+        url = reverse('admin-process-image-uploads')
+        client = APIClient()
+        self.assertEqual(client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.json(), {'requeued': 0, 'processed': 1})
+        self.assertEqual(self.client.get(url).json(), {'requeued': 0, 'processed': 1})
+        self.assertEqual(ProductImage.objects.count(), 2)
+
+
+class ImageDeduplicationTest(ImageMediaTestMixin, ProductFixtureMixin, CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first, cls.second = cls.create_products(2, images=0)
+        cls.admin = get_user_model().objects.create_superuser(email='admin@example.com', password='pass')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def upload_to(self, product, file):
+        return self.upload(reverse('product-images-list', args=[product.pk]), file)
+
+    def test_same_content_reuses_the_asset(self):
+        content = make_image_file().read()
+        with mock.patch.object(LocalImageBackend, 'store', autospec=True,
+                               side_effect=LocalImageBackend.store) as store:
+            self.upload_to(self.first, SimpleUploadedFile('a.png', content))
+            self.upload_to(self.second, SimpleUploadedFile('b.png', content))
+        self.assertEqual(store.call_count, 1)
+        first, second = ProductImage.objects.order_by('pk')
+        self.assertEqual(first.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual((second.product_id, second.content_hash), (self.second.pk, first.content_hash))
+        self.assertEqual(second.image.public_id, first.image.public_id)
+        self.assertEqual(second.variants, first.variants)
+
+    def test_different_content_is_uploaded(self):
+        self.upload_to(self.first, make_image_file(color='red'))
+        self.upload_to(self.first, make_image_file(color='blue'))
+        first, second = ProductImage.objects.order_by('pk')
+        self.assertNotEqual(first.content_hash, second.content_hash)
+        self.assertNotEqual(first.image.public_id, second.image.public_id)
+
+    def test_update_reuses_the_asset(self):
+        content = make_image_file().read()
+        self.upload_to(self.first, SimpleUploadedFile('a.png', content))
+        self.upload_to(self.second, make_image_file(color='blue'))
+        image = ProductImage.objects.get(product=self.second)
+        response = self.upload(reverse('product-images-detail', args=[self.second.pk, image.pk]),
+                               SimpleUploadedFile('c.png', content), method='patch')
+        self.assertEqual(response.status_code, 202)
+        image.refresh_from_db()
+        self.assertEqual(image.image.public_id, ProductImage.objects.get(product=self.first).image.public_id)
+
+    def test_backfill_command(self):
+        content = make_image_file().read()
+        self.upload_to(self.first, SimpleUploadedFile('a.png', content))
+        ProductImage.objects.update(content_hash='')
+        ImageAsset.objects.all().delete()
+        out = io.StringIO()
+        call_command('backfill_image_hashes', stdout=out, stderr=io.StringIO())
+        self.assertIn('Hashed 1 images, 0 failed', out.getvalue())
+        self.assertEqual(ProductImage.objects.get().content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(ImageAsset.objects.get().image.public_id, ProductImage.objects.get().image.public_id)
+
+    def test_concurrent_upload_of_the_same_file_settles_on_one_asset(self):
+        content = make_image_file().read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        store = LocalImageBackend.store
+
+        def store_alongside(backend, file):
+            # Another upload of the same file records its asset while this one is uploading
+            image, variants = store(backend, SimpleUploadedFile('other.png', content))
+            ImageAsset.objects.create(content_hash=content_hash, image=image, variants=variants)
+            return store(backend, file)
+
+        with mock.patch.object(LocalImageBackend, 'store', autospec=True, side_effect=store_alongside):
+            self.upload_to(self.first, SimpleUploadedFile('a.png', content))
+        asset = ImageAsset.objects.get()
+        self.assertEqual(ProductImage.objects.get().image.public_id, asset.image.public_id)
 
-# Create your tests here.
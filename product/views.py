@@ -1,38 +1,157 @@
-from product.models import Product, Category, Review, ProductImage, Wishlist
-from product.serializers import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer, WishlistSerializer
-from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count
-from rest_framework.viewsets import ModelViewSet
+from product.models import Product, Category, Review, ProductImage, ProductImageUpload, Wishlist
+from product.serializers import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer, WishlistSerializer, ProductImageUploadSerializer
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from django_filters.rest_framework import DjangoFilterBackend
-from product.filters import ProductFilter
-from rest_framework.filters import SearchFilter, OrderingFilter
-from product.paginations import DefaultPagination
+from django_filters.utils import translate_validation
+from product.filters import ProductFilter, ProductSearchFilter, StableOrderingFilter
+from product.facets import product_facets
+from product.pricing import annotate_price_with_tax, tax_rates
+from product.fieldsets import FIELDSET_PARAMETERS, trim_queryset
+from product.fast_serializers import FastReadMixin
+from product.wishlist import (WITH_WISHLIST_PARAM, WISHLIST_PARAMETERS, annotate_in_wishlist, invalidate_wishlist,
+                              query_wishlist_ids, wants_wishlist, wishlist_product_ids)
+from rest_framework.filters import OrderingFilter
+from product.paginations import DefaultPagination, KeysetPaginationMixin, ReviewPagination
+from product.response_cache import CachedResponseMixin
+from product.conditional import ConditionalGetMixin
 from api.permissions import IsAdminOrReadOnly
+from api.query_budget import QueryBudgetMixin
 from product.permissions import IsReviewAuthorOrReadonly
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.decorators import action
-
-
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.all()
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
+from django.db.models import ProtectedError
+from rest_framework import status
+from product.ratings import apply_rating_change
+
+
+class ProductViewSet(CachedResponseMixin, QueryBudgetMixin, ConditionalGetMixin, KeysetPaginationMixin, FastReadMixin,
+                     ModelViewSet):
+    queryset = Product.objects.defer('search_vector').prefetch_related('images')
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     pagination_class = DefaultPagination
-    search_fields = ['name', 'description']
-    ordering_fields = ['price', 'updated_at']
+    ordering_fields = ['price', 'price_with_tax', 'updated_at', 'avg_rating']
     permission_classes = [IsAdminOrReadOnly]
+    # Includes the validator query, the tax rates on a cold catalog cache, the JWT
+    # user lookup on authenticated requests and the wishlist ids behind
+    # ?with_wishlist= validators on a cache miss
+    query_budgets = {'list': 7, 'retrieve': 5, 'latest': 3, 'facets': 4}
+    cached_actions = ('list', 'retrieve', 'latest', 'facets')
+    fast_read_actions = ('list', 'latest')
+    # Categories hold the tax rates and the facet names
+    cache_dependencies = ('product', 'productimage', 'category')
+    bulk_max_items = 1000
+
+    @cached_property
+    def category_tax_rates(self):
+        return tax_rates()
+
+    def get_queryset(self):
+        queryset = trim_queryset(super().get_queryset(), self.serializer_class, self.request,
+                                 extra_columns=self.ordering_fields)
+        if wants_wishlist(self.request):
+            queryset = annotate_in_wishlist(queryset, self.request.user)
+        return annotate_price_with_tax(queryset, self.category_tax_rates)
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'with_wishlist': wants_wishlist(self.request)}
+
+    def get_validator_parts(self):
+        parts = (sorted(self.category_tax_rates.items()),)
+        if wants_wishlist(self.request):
+            # Wishlist changes don't touch the products
+            parts += (wishlist_product_ids(self.request.user.pk),)
+        return parts
+
+    def get_response_cache_key(self, request):
+        # Runs before authentication, any request asking for the wishlist is left alone
+        if WITH_WISHLIST_PARAM in request.GET:
+            return None
+        return super().get_response_cache_key(request)
 
     @action(detail=False, methods=['get'])
-    @swagger_auto_schema(tags=['Products'], operation_summary='Get latest 10 products')
+    @swagger_auto_schema(tags=['Products'], operation_summary='Get latest 10 products',
+                         manual_parameters=FIELDSET_PARAMETERS + WISHLIST_PARAMETERS)
     def latest(self, request):
         from rest_framework.response import Response
-        latest_products = Product.objects.all().order_by('-created_at')[:8]
+        latest_products = self.get_queryset().order_by('-created_at')[:8]
         serializer = self.get_serializer(latest_products, many=True)
         return Response(serializer.data)
 
-    @swagger_auto_schema(tags=['Products'], operation_summary='Retrieve a list of products')
+    @action(detail=False, methods=['get'])
+    @swagger_auto_schema(
+        tags=['Products'],
+        operation_summary='Category counts and price histogram for a product search',
+        operation_description="Takes the same `search`, `category_id`, `price__gt`/`price__lt` and "
+                              "`price_with_tax__gt`/`price_with_tax__lt` params as the product list. Category counts ignore the category filter "
+                              "and price buckets ignore the price filter, so the other options stay visible.",
+    )
+    def facets(self, request):
+        from rest_framework.response import Response
+        filterset = self.filterset_class(request.query_params, queryset=Product.objects.all(), request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+
+        products = Product.objects.all()
+        filters = filterset.form.cleaned_data
+        if filters.get('price_with_tax__gt') is not None or filters.get('price_with_tax__lt') is not None:
+            products = annotate_price_with_tax(products, self.category_tax_rates)
+        queryset = ProductSearchFilter().filter_queryset(request, products, self)
+        categories = list(Category.objects.order_by('name', 'id').values_list('id', 'name'))
+        return Response(product_facets(queryset, categories, filters))
+
+    @action(detail=False, methods=['post', 'put', 'patch', 'delete'])
+    @swagger_auto_schema(
+        tags=['Products'],
+        operation_summary='Bulk create, update or delete products by admin',
+        operation_description="POST a list of products to create them, PUT/PATCH a list of "
+                              "products with their `id` to update them, DELETE `{\"ids\": [...]}`. "
+                              "Errors are returned per item and nothing is saved unless every item is valid.",
+    )
+    def bulk(self, request):
+        from rest_framework.response import Response
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+
+        instance = None
+        if request.method in ('PUT', 'PATCH'):
+            ids = [item.get('id') for item in request.data if isinstance(item, dict)] \
+                if isinstance(request.data, list) else []
+            instance = list(Product.objects.filter(pk__in=[pk for pk in ids if isinstance(pk, int)]))
+
+        serializer = self.get_serializer(
+            instance, data=request.data, many=True, partial=request.method == 'PATCH',
+            max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED
+                        if instance is None else status.HTTP_200_OK)
+
+    def bulk_destroy(self, request):
+        from rest_framework.response import Response
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            return Response({'ids': ['Expected a list of product ids.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.filter(pk__in=ids)
+        found = set(products.values_list('pk', flat=True))
+        try:
+            deleted = products.delete()[1].get(Product._meta.label, 0)
+        except ProtectedError as error:
+            protected = sorted({obj.product_id for obj in error.protected_objects})
+            return Response({'detail': 'Some products are referenced by orders.', 'protected_ids': protected},
+                            status=status.HTTP_409_CONFLICT)
+        return Response({'deleted': deleted, 'missing_ids': sorted(set(ids) - found)})
+
+    @swagger_auto_schema(tags=['Products'], operation_summary='Retrieve a list of products',
+                         manual_parameters=FIELDSET_PARAMETERS + WISHLIST_PARAMETERS)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
@@ -46,7 +165,8 @@ class ProductViewSet(ModelViewSet):
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
 
-    @swagger_auto_schema(tags=['Products'], operation_summary='Retrieve a specific product')
+    @swagger_auto_schema(tags=['Products'], operation_summary='Retrieve a specific product',
+                         manual_parameters=FIELDSET_PARAMETERS + WISHLIST_PARAMETERS)
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
@@ -63,33 +183,74 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ProductImageViewSet(ModelViewSet):
+class ProductImageUploadViewSet(ReadOnlyModelViewSet):
+    serializer_class = ProductImageUploadSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return ProductImageUpload.objects.filter(
+            product_id=self.kwargs.get('product_pk')).select_related('image').order_by('-created_at')
+
+    @swagger_auto_schema(tags=['Product Images'], operation_summary='List product image uploads')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @swagger_auto_schema(tags=['Product Images'], operation_summary='Get product image upload status')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class ProductImageViewSet(CachedResponseMixin, ModelViewSet):
     serializer_class = ProductImageSerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_dependencies = ('productimage',)
 
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs.get('product_pk'))
 
-    def perform_create(self, serializer):
-        serializer.save(product_id=self.kwargs.get('product_pk'))
-
     @swagger_auto_schema(tags=['Product Images'], operation_summary='List product images')
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    @swagger_auto_schema(tags=['Product Images'], operation_summary='Add product image')
+    @swagger_auto_schema(tags=['Product Images'], operation_summary='Add product image',
+                         request_body=ProductImageUploadSerializer,
+                         responses={202: ProductImageUploadSerializer})
     def create(self, request, *args, **kwargs):
-        return super().create(request, *args, **kwargs)
+        """
+        The file is staged and acknowledged with a pending upload; the upload
+        queue stores it and the image is listed once the upload is done.
+        Follow it at /products/{product_pk}/image-uploads/{id}/
+        """
+        from rest_framework.response import Response
+        product = get_object_or_404(Product.objects.only('pk'), pk=self.kwargs.get('product_pk'))
+        serializer = ProductImageUploadSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save(product_id=product.pk)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
     @swagger_auto_schema(tags=['Product Images'], operation_summary='Get product image')
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-    @swagger_auto_schema(tags=['Product Images'], operation_summary='Update product image')
+    @swagger_auto_schema(tags=['Product Images'], operation_summary='Update product image',
+                         request_body=ProductImageUploadSerializer,
+                         responses={202: ProductImageUploadSerializer})
     def update(self, request, *args, **kwargs):
-        return super().update(request, *args, **kwargs)
-
-    @swagger_auto_schema(tags=['Product Images'], operation_summary='Partially update product image')
+        """
+        The new file goes through the upload queue like an added image, which
+        keeps serving its current file until the upload is done.
+        Follow it at /products/{product_pk}/image-uploads/{id}/
+        """
+        from rest_framework.response import Response
+        image = self.get_object()
+        serializer = ProductImageUploadSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save(product_id=image.product_id, replaces=image)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @swagger_auto_schema(tags=['Product Images'], operation_summary='Partially update product image',
+                         request_body=ProductImageUploadSerializer,
+                         responses={202: ProductImageUploadSerializer})
     def partial_update(self, request, *args, **kwargs):
         return super().partial_update(request, *args, **kwargs)
 
@@ -98,10 +259,11 @@ class ProductImageViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(CachedResponseMixin, ConditionalGetMixin, FastReadMixin, ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
-    queryset = Category.objects.annotate(product_count=Count('products')).all()
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_dependencies = ('category',)
 
     @swagger_auto_schema(tags=['Categories'], operation_summary='List all categories')
     def list(self, request, *args, **kwargs):
@@ -128,17 +290,25 @@ class CategoryViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(QueryBudgetMixin, KeysetPaginationMixin, FastReadMixin, ModelViewSet):
     serializer_class = ReviewSerializer
     permission_classes = [IsReviewAuthorOrReadonly]
-
-    @action(detail=False, methods=['get'])
+    pagination_class = ReviewPagination
+    # Both orderings are served by the (product, ...) and (user, ...) review indexes
+    filter_backends = [StableOrderingFilter]
+    ordering_fields = ['created_at', 'ratings']
+    ordering = ['-created_at']
+    fast_read_actions = ('list', 'my_reviews')
+    # A page and its count, whatever the number of reviews
+    query_budgets = {'list': 3, 'my_reviews': 3}
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     @swagger_auto_schema(tags=['Reviews'], operation_summary='Get my reviews')
     def my_reviews(self, request):
-        from rest_framework.response import Response
-        reviews = Review.objects.filter(user=request.user)
-        serializer = self.get_serializer(reviews, many=True)
-        return Response(serializer.data)
+        reviews = self.filter_queryset(Review.objects.filter(user=request.user).select_related('user'))
+        page = self.paginate_queryset(reviews)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @swagger_auto_schema(tags=['Reviews'], operation_summary='List product reviews')
     def list(self, request, *args, **kwargs):
@@ -164,11 +334,33 @@ class ReviewViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        review = serializer.save(user=self.request.user)
+        apply_rating_change(review.product_id, added=review.ratings)
 
+    @transaction.atomic
     def perform_update(self, serializer):
-        serializer.save(user=self.request.user)
+        old_rating = self.lock_rating(serializer.instance)
+        review = serializer.save(user=self.request.user)
+        apply_rating_change(review.product_id, added=review.ratings, removed=old_rating)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        rating = self.lock_rating(instance)
+        instance.delete()
+        apply_rating_change(instance.product_id, removed=rating)
+
+    def lock_rating(self, review):
+        """
+        The review's current rating, read under a row lock: a concurrent update or
+        delete of the same review waits, then sees what this one left behind,
+        so each change is folded into the product aggregates exactly once.
+        """
+        rating = Review.objects.select_for_update().filter(pk=review.pk).values_list('ratings', flat=True).first()
+        if rating is None:
+            raise Http404
+        return rating
 
     def get_queryset(self):
         product_pk = self.kwargs.get('product_pk')
@@ -178,17 +370,54 @@ class ReviewViewSet(ModelViewSet):
             queryset = Review.objects.all()
         if not self.request.user.is_staff:
             queryset = queryset.filter(user=self.request.user)
-        return queryset
+        return queryset.select_related('user')
 
     def get_serializer_context(self):
         return {'product_id': self.kwargs.get('product_pk')}
 
 
-class WishlistViewSet(ModelViewSet):
+class WishlistViewSet(KeysetPaginationMixin, ModelViewSet):
     serializer_class = WishlistSerializer
     permission_classes = [IsAuthenticated]
+    batch_max_items = 100
+
+    @action(detail=False, methods=['get'])
+    @swagger_auto_schema(tags=['Wishlist'], operation_summary='Ids of the products in my wishlist')
+    def ids(self, request):
+        from rest_framework.response import Response
+        return Response({'product_ids': wishlist_product_ids(request.user.pk)})
+
+    @action(detail=False, methods=['post', 'delete'])
+    @swagger_auto_schema(
+        tags=['Wishlist'],
+        operation_summary='Add or remove several products',
+        operation_description="POST `{\"product_ids\": [...]}` to add products, DELETE it to remove them. "
+                              "Products already in, or not in, the wishlist are skipped. Returns the ids "
+                              "now in the wishlist and the requested ids that aren't products.",
+    )
+    def batch(self, request):
+        from rest_framework.response import Response
+        ids = request.data.get('product_ids') if isinstance(request.data, dict) else None
+        if (not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids)
+                or len(ids) > self.batch_max_items):
+            return Response({'product_ids': [f'Expected a list of at most {self.batch_max_items} product ids.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        missing = []
+        if request.method == 'POST':
+            found = set(Product.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            missing = sorted(set(ids) - found)
+            # Rows already there hit the (user, product) unique constraint and are skipped
+            Wishlist.objects.bulk_create(
+                [Wishlist(user=request.user, product_id=pk) for pk in sorted(found)], ignore_conflicts=True)
+        else:
+            Wishlist.objects.filter(user=request.user, product_id__in=ids).delete()
+        # bulk_create sends no signals
+        invalidate_wishlist(request.user.pk)
+        return Response({'product_ids': query_wishlist_ids(request.user.pk), 'missing_ids': missing})
 
-    @swagger_auto_schema(tags=['Wishlist'], operation_summary="List user's wishlist items")
+    @swagger_auto_schema(tags=['Wishlist'], operation_summary="List user's wishlist items",
+                         manual_parameters=FIELDSET_PARAMETERS)
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
@@ -213,7 +442,9 @@ class WishlistViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        queryset = Wishlist.objects.filter(user=self.request.user).select_related(
+            'product').prefetch_related('product__images')
+        return trim_queryset(queryset, self.serializer_class, self.request)
 
     def get_serializer_context(self):
         return {'request': self.request}
@@ -0,0 +1,44 @@
+from django.db.models import Exists, OuterRef
+from drf_yasg import openapi
+from product.models import Wishlist
+from product.response_cache import get_cache, get_generations, invalidate
+
+WISHLIST_IDS_KEY = 'catalog:wishlist-ids:{}:{}'
+WITH_WISHLIST_PARAM = 'with_wishlist'
+
+WISHLIST_PARAMETERS = [
+    openapi.Parameter(WITH_WISHLIST_PARAM, openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                      description='Add `in_wishlist` to each product, for authenticated users'),
+]
+
+
+def wants_wishlist(request):
+    return (request.user.is_authenticated
+            and request.query_params.get(WITH_WISHLIST_PARAM, '').lower() in ('1', 'true'))
+
+
+def query_wishlist_ids(user_id):
+    return list(Wishlist.objects.filter(user_id=user_id).order_by('product_id').values_list('product_id', flat=True))
+
+
+def wishlist_product_ids(user_id):
+    """
+    Sorted ids of the products in a user's wishlist, from the catalog cache.
+    Keyed by a per-user generation that invalidate_wishlist bumps.
+    """
+    generation, = get_generations([f'wishlist:{user_id}'])
+    key = WISHLIST_IDS_KEY.format(user_id, generation)
+    ids = get_cache().get(key)
+    if ids is None:
+        ids = query_wishlist_ids(user_id)
+        get_cache().set(key, ids)
+    return ids
+
+
+def invalidate_wishlist(user_id):
+    invalidate(f'wishlist:{user_id}')
+
+
+def annotate_in_wishlist(queryset, user):
+    """`in_wishlist` per product with one EXISTS on the (user, product) unique index"""
+    return queryset.annotate(in_wishlist=Exists(Wishlist.objects.filter(user=user, product=OuterRef('pk'))))